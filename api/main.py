@@ -2,20 +2,26 @@ from fastapi import FastAPI
 import os
 import sqlalchemy
 import uvicorn
-import psycopg2
 
 app = FastAPI()
 
 
-@app.get("/")
-def read_root():
+def get_url():
+    # the api deploys on its own, so it builds the url itself rather than
+    # importing data/db.py. with DB_BACKEND=sqlite, DATABASE is the file's path
     database = os.environ.get("DATABASE")
+    if os.environ.get("DB_BACKEND") == "sqlite":
+        return f"sqlite:///{database or 'heisman.db'}"
+
     user = os.environ.get("DB_USER")
     password = os.environ.get("DB_PASSWORD")
     host = os.environ.get("DB_HOST")
+    return f"postgresql+psycopg2://{user}:{password}@{host}/{database}"
 
-    url = f"postgresql+psycopg2://{user}:{password}@{host}/{database}"
-    engine = sqlalchemy.create_engine(url)
+
+@app.get("/")
+def read_root():
+    engine = sqlalchemy.create_engine(get_url())
 
     sql = f"""
     select * 
@@ -0,0 +1,465 @@
+import argparse
+import json
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import psycopg2
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent.joinpath("../data").resolve()))
+
+import build_db
+import crawl
+import db
+import fetch
+import metrics
+import page_cache
+import update_player_table
+
+
+# offline ingest benchmark. recorded sports-reference pages (a page cache
+# directory, see page_cache.py) are served by a local stand-in server running
+# in its own process, and the real ingest entry point crawls it into a
+# throwaway database (a temporary sqlite file, or a schema in the postgres
+# database given with --dsn) so crawler/loader changes can be compared commit
+# to commit without touching the real site or the real database.
+#
+#   generate synthetic fixtures (offline and deterministic, what CI runs on):
+#       python benchmarks/ingest_benchmark.py generate --start 2019 --end 2021
+#   or record real ones once (hits the real site, rate limited):
+#       python benchmarks/ingest_benchmark.py record --start 2019 --end 2021
+#   run the benchmark (generates any seasons the fixtures don't have yet):
+#       python benchmarks/ingest_benchmark.py run --start 2019 --end 2021
+ORIGINS = ["https://www.sports-reference.com", "http://www.sports-reference.com"]
+SITE = "https://www.sports-reference.com/cfb"
+FIXTURES_DIR = Path(__file__).parent.joinpath("fixtures/pages")
+
+# size of the synthetic site, roughly a real power 5 season
+SCHOOLS_PER_CONFERENCE = 12
+PLAYERS_PER_ROSTER = 40
+HEISMAN_FINALISTS = 10
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def lookup(self, method):
+        # the stand-in only sees the path, so try each origin it was recorded under
+        for origin in ORIGINS:
+            response = page_cache.lookup(method, origin + self.path)
+            if response is not None:
+                return response
+        return None
+
+    def respond(self, method):
+        response = self.lookup(method)
+        if response is None:
+            self.send_error(404)
+            return
+        self.send_response(response.status_code)
+        self.send_header("Content-Type", response.headers.get("Content-Type") or "")
+        self.send_header("Content-Length", str(len(response.content)))
+        self.end_headers()
+        if method == "GET":
+            self.wfile.write(response.content)
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_HEAD(self):
+        self.respond("HEAD")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(fixtures, port):
+    page_cache.settings.update({"dir": str(fixtures), "offline": True})
+    ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler).serve_forever()
+
+
+def page(title, body):
+    return f"<html><head><title>{title}</title></head><body>{body}</body></html>"
+
+
+def table(table_id, rows, footer=""):
+    body = f'<table id="{table_id}"><tbody>{"".join(rows)}</tbody>'
+    if footer:
+        body += f"<tfoot>{footer}</tfoot>"
+    return body + "</table>"
+
+
+def cells(stats):
+    return "".join(f'<td data-stat="{stat}">{value}</td>' for stat, value in stats)
+
+
+def school_link(key, year, tag="th"):
+    name = key.replace("-", " ").title()
+    return (
+        f'<{tag} data-stat="school_name">'
+        f'<a href="/cfb/schools/{key}/{year}.html">{name}</a></{tag}>'
+    )
+
+
+def player_link(player_id):
+    name = player_id.replace("-", " ").title()
+    return (
+        f'<th data-stat="player"><a href="/cfb/players/{player_id}.html">'
+        f"{name}</a></th>"
+    )
+
+
+def season_row(year, key, position, rng):
+    # one season of a player's stats tables, in the columns sportsipy reads
+    stats = [
+        ("class", rng.choice(["FR", "SO", "JR", "SR"])),
+        ("pos", position),
+        ("g", rng.randint(1, 14)),
+    ]
+    if position == "QB":
+        attempts = rng.randint(50, 500)
+        completions = rng.randint(attempts // 2, attempts)
+        stats += [
+            ("pass_cmp", completions),
+            ("pass_att", attempts),
+            ("pass_cmp_pct", round(100 * completions / attempts, 1)),
+            ("pass_yds", completions * rng.randint(8, 14)),
+            ("pass_td", rng.randint(0, 50)),
+            ("pass_int", rng.randint(0, 20)),
+            ("pass_yds_per_att", round(rng.uniform(5, 12), 1)),
+            ("adj_pass_yds_per_att", round(rng.uniform(5, 13), 1)),
+            ("pass_rating", round(rng.uniform(90, 200), 1)),
+        ]
+    if position in ("QB", "RB", "WR"):
+        stats += [
+            ("rush_att", rng.randint(0, 300)),
+            ("rush_yds", rng.randint(0, 2000)),
+            ("rush_yds_per_att", round(rng.uniform(0, 8), 1)),
+            ("rush_td", rng.randint(0, 25)),
+            ("rec", rng.randint(0, 100)),
+            ("rec_yds", rng.randint(0, 1500)),
+            ("rec_yds_per_rec", round(rng.uniform(0, 20), 1)),
+            ("rec_td", rng.randint(0, 20)),
+            ("scrim_att", rng.randint(0, 400)),
+            ("scrim_yds", rng.randint(0, 2500)),
+            ("scrim_yds_per_att", round(rng.uniform(0, 10), 1)),
+            ("scrim_td", rng.randint(0, 30)),
+        ]
+    else:
+        stats += [
+            ("tackles_solo", rng.randint(0, 80)),
+            ("tackles_assists", rng.randint(0, 60)),
+            ("tackles_total", rng.randint(0, 140)),
+            ("tackles_loss", round(rng.uniform(0, 20), 1)),
+            ("sacks", round(rng.uniform(0, 15), 1)),
+            ("def_int", rng.randint(0, 8)),
+            ("def_int_yds", rng.randint(0, 150)),
+            ("def_int_yds_per_int", round(rng.uniform(0, 30), 1)),
+            ("def_int_td", rng.randint(0, 2)),
+            ("pass_defended", rng.randint(0, 20)),
+            ("fumbles_rec", rng.randint(0, 3)),
+            ("fumbles_rec_yds", rng.randint(0, 50)),
+            ("fumbles_rec_td", rng.randint(0, 1)),
+            ("fumbles_forced", rng.randint(0, 5)),
+        ]
+    stats += [
+        ("td_total", rng.randint(0, 30)),
+        ("points", rng.randint(0, 180)),
+    ]
+    school = f'<td data-stat="school_name"><a href="/cfb/schools/{key}/">{key}</a></td>'
+    return f'<tr><th data-stat="year_id">{year}</th>{school}{cells(stats)}</tr>'
+
+
+def generate_season(year, rng):
+    # every page one season's ingest pulls, as {url: html}
+    pages = {}
+    conferences = {}
+    for conf in crawl.get_season_conferences(year):
+        if conf == "independents":
+            # the crawl hard codes these, but Team still looks them up
+            conferences["independent"] = ["notre-dame", "brigham-young"]
+        else:
+            conferences[conf] = [
+                f"{conf}-school-{i}" for i in range(1, SCHOOLS_PER_CONFERENCE + 1)
+            ]
+
+    pages[f"{SITE}/years/{year}.html"] = page(
+        f"{year} season",
+        table(
+            "conferences",
+            [
+                f'<tr><td data-stat="conf_name">'
+                f'<a href="/cfb/conferences/{conf}/{year}.html">{conf}</a></td></tr>'
+                for conf in conferences
+            ],
+        ),
+    )
+
+    standings, offense, defense = [], [], []
+    players = []
+    for conf, schools in conferences.items():
+        pages[f"{SITE}/conferences/{conf}/{year}.html"] = page(
+            f"{conf} {year}",
+            table(
+                "standings", [f"<tr>{school_link(key, year)}</tr>" for key in schools]
+            ),
+        )
+        for key in schools:
+            conference = f'<td data-stat="conf_abbr"><a>{conf}</a></td>'
+            standings.append(
+                f"<tr>{school_link(key, year, 'td')}{conference}"
+                + cells(
+                    [
+                        ("win_loss_pct", round(rng.random(), 3)),
+                        ("srs", round(rng.uniform(-20, 30), 2)),
+                        ("sos", round(rng.uniform(-10, 12), 2)),
+                    ]
+                )
+                + "</tr>"
+            )
+            offense.append(
+                f"<tr>{school_link(key, year, 'td')}"
+                + cells([("points_per_g", round(rng.uniform(10, 50), 1))])
+                + "</tr>"
+            )
+            defense.append(
+                f"<tr>{school_link(key, year, 'td')}"
+                + cells([("opp_points_per_g", round(rng.uniform(10, 40), 1))])
+                + "</tr>"
+            )
+
+            roster = []
+            for i in range(PLAYERS_PER_ROSTER):
+                player_id = f"{key}-{year}-{i}"
+                position = rng.choice(["QB", "RB", "WR", "LB", "DB", "DL"])
+                roster.append(f"<tr>{player_link(player_id)}</tr>")
+                players.append(player_id)
+                # a season row plus the career footer sportsipy expects
+                tables = "".join(
+                    table(
+                        table_id,
+                        [season_row(year, key, position, rng)],
+                        '<tr><th data-stat="year_id">Career</th></tr>',
+                    )
+                    for table_id in ("passing", "rushing", "defense")
+                )
+                pages[f"{SITE}/players/{player_id}.html"] = page(
+                    player_id,
+                    f'<h1 itemprop="name">{player_id}</h1>'
+                    f'<span itemprop="height">6-2</span>'
+                    f'<span itemprop="weight">{rng.randint(170, 300)}lb</span>'
+                    + tables,
+                )
+            pages[f"{SITE}/schools/{key}/{year}-roster.html"] = page(
+                f"{key} {year} roster", table("roster", roster)
+            )
+
+    # the standings are read out of a div wrapping the table, over plain http
+    pages[f"http://www.sports-reference.com/cfb/years/{year}-standings.html"] = page(
+        f"{year} standings",
+        f'<div id="div_standings">{table("standings", standings)}</div>',
+    )
+    pages[f"{SITE}/years/{year}-team-offense.html"] = page(
+        f"{year} offense", table("offense", offense)
+    )
+    pages[f"{SITE}/years/{year}-team-defense.html"] = page(
+        f"{year} defense", table("defense", defense)
+    )
+
+    # votes are the second to last column of the heisman table
+    pages[f"{SITE}/awards/heisman-{year}.html"] = page(
+        f"{year} heisman",
+        table(
+            "heisman",
+            [
+                f"<tr>{player_link(player_id)}"
+                + cells([("votes", rng.randint(1, 3000)), ("share", 0)])
+                + "</tr>"
+                for player_id in rng.sample(players, HEISMAN_FINALISTS)
+            ],
+        ),
+    )
+    return pages
+
+
+def missing_seasons(fixtures, years):
+    # the heisman page is the last one generate_season writes, so a season
+    # without it was never generated (or recorded) completely
+    page_cache.settings["dir"] = str(fixtures)
+    return [
+        year
+        for year in years
+        if page_cache.read_entry("GET", f"{SITE}/awards/heisman-{year}.html") is None
+    ]
+
+
+def generate(fixtures, years):
+    # a deterministic stand-in for the real site, written in the page cache
+    # format so it's served exactly like recorded fixtures
+    page_cache.settings["dir"] = str(fixtures)
+    count = 0
+    for year in years:
+        for url, html in generate_season(year, random.Random(year)).items():
+            response = requests.models.Response()
+            response.status_code = 200
+            response.reason = "OK"
+            response.headers["Content-Type"] = "text/html; charset=utf-8"
+            response.encoding = "utf-8"
+            response._content = html.encode()
+            page_cache.store("GET", url, response)
+            count += 1
+    print(f"Wrote {count} synthetic pages to {fixtures}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(fixtures):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, __file__, "serve", "--fixtures", str(fixtures)]
+        + ["--port", str(port)]
+    )
+    # wait for the stand-in to start listening
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("stand-in server didn't start")
+
+
+def connect(dsn, workdir):
+    # postgres only when it's asked for explicitly, never config.yml's
+    # database. otherwise a sqlite file that's deleted with workdir
+    if dsn:
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        return conn
+    return db.connect(
+        {"db": {"backend": "sqlite", "path": str(workdir.joinpath("bench.db"))}}
+    )
+
+
+def ingest_pass(cursor, years, workers):
+    metrics.reset()
+    start = time.perf_counter()
+    update_player_table.main(cursor, years, workers, resume=False)
+    wall = time.perf_counter() - start
+
+    summary = metrics.summarize()
+    players = summary["counters"].get("player_rows_written", 0)
+    summary["wall_seconds"] = wall
+    summary["players_per_second"] = players / wall if wall else 0
+    return summary
+
+
+def git_revision():
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def run(args):
+    years = range(args.start, args.end + 1)
+    server = None
+    workdir = Path(tempfile.mkdtemp(prefix="ingest-bench-"))
+    if args.command == "run":
+        missing = missing_seasons(args.fixtures, years)
+        if missing:
+            generate(args.fixtures, missing)
+    if args.command == "record":
+        # record straight into the fixtures through the normal, rate limited path
+        fetch.install({"cache": {"dir": str(args.fixtures)}})
+    else:
+        server, base_url = start_server(args.fixtures)
+        fetch.install(
+            {
+                "fetch": {
+                    "min_interval": 0,
+                    "retries": 0,
+                    "base_urls": {origin: base_url for origin in ORIGINS},
+                },
+                # start from an empty cache so the cold pass fetches every page
+                "cache": {"dir": str(workdir.joinpath("cache"))},
+            }
+        )
+
+    # everything goes into a throwaway database that's dropped afterwards, on
+    # postgres that's a schema of its own
+    conn = connect(args.dsn, workdir)
+    cursor = conn.cursor()
+    if args.dsn:
+        schema = f"bench_{uuid.uuid4().hex[:8]}"
+        cursor.execute(f"CREATE SCHEMA {schema};")
+        cursor.execute(f"SET search_path TO {schema};")
+
+    try:
+        build_db.main(cursor)
+        report = {
+            "revision": git_revision(),
+            "seasons": [args.start, args.end],
+            "workers": args.workers,
+            "cold": ingest_pass(cursor, years, args.workers),
+        }
+        if args.command == "run":
+            # second pass is served entirely from the ingest's own page cache
+            report["warm"] = ingest_pass(cursor, years, args.workers)
+    finally:
+        if args.dsn:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+        conn.close()
+        if server is not None:
+            server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name in ("cold", "warm"):
+        if name in report:
+            print(
+                f"{name}: {report[name]['players_per_second']:.1f} players/s, "
+                f"{report[name]['wall_seconds']:.1f}s"
+            )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark report to {args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["run", "record", "generate", "serve"])
+    parser.add_argument("--start", type=int, default=2019, help="first season")
+    parser.add_argument("--end", type=int, default=2021, help="last season")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR)
+    parser.add_argument("--port", type=int, help="port for the stand-in server")
+    parser.add_argument(
+        "--dsn",
+        help="postgres database to run in (in a throwaway schema), "
+        "defaults to a temporary sqlite file",
+    )
+    parser.add_argument("--output", default="ingest_benchmark.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "serve":
+        serve(args.fixtures, args.port)
+    elif args.command == "generate":
+        generate(args.fixtures, range(args.start, args.end + 1))
+    else:
+        run(args)
@@ -1,6 +1,6 @@
-import psycopg2
 import yaml
 from pathlib import Path
+import db
 
 
 # from https://stackoverflow.com/a/63170705
@@ -11,7 +11,22 @@ def get_settings():
     return settings_data
 
 
+# the team table's current columns in table order, shared with the ingest
+# scripts like PLAYER_COLUMNS
+TEAM_COLUMNS = [
+    ("team_id", "varchar(50) NOT NULL"),
+    ("season", "integer NOT NULL"),
+    ("conference", "varchar(20) NOT NULL"),
+    ("win_percentage", "real NOT NULL"),
+    ("points_per_game", "real NOT NULL"),
+    ("points_against_per_game", "real NOT NULL"),
+    ("strength_of_schedule", "real NOT NULL"),
+    ("simple_rating_system", "real NOT NULL"),
+]
+
+
 def create_team_table(cursor):
+    # the table as migration 1 created it, frozen like the migration itself
     sql = """CREATE TABLE team(
                 team_id varchar(50) NOT NULL,
                 season integer NOT NULL,
@@ -26,7 +41,71 @@ def create_team_table(cursor):
     cursor.execute(sql)
 
 
+# the player table's current columns in table order, what the ingest
+# scripts read. the migrations don't, they spell out the columns as they
+# were when they shipped, so a new stat needs a new migration that adds the
+# column as well as its entry here
+PLAYER_COLUMNS = [
+    ("player_id", "varchar(50) NOT NULL"),
+    ("season", "integer NOT NULL"),
+    ("team_abbreviation", "varchar(30) NOT NULL"),
+    ("position", "char(4) NOT NULL"),
+    ("year", "varchar(4) NOT NULL"),
+    ("games", "integer NOT NULL"),
+    ("completed_passes", "integer NOT NULL"),
+    ("pass_attempts", "integer NOT NULL"),
+    ("passing_completion", "integer NOT NULL"),
+    ("passing_yards", "integer NOT NULL"),
+    ("passing_touchdowns", "integer NOT NULL"),
+    ("interceptions_thrown", "integer NOT NULL"),
+    ("passing_yards_per_attempt", "real NOT NULL"),
+    ("adjusted_yards_per_attempt", "real NOT NULL"),
+    ("quarterback_rating", "real NOT NULL"),
+    ("rush_attempts", "integer NOT NULL"),
+    ("rush_yards", "integer NOT NULL"),
+    ("rush_yards_per_attempt", "real NOT NULL"),
+    ("rush_touchdowns", "integer NOT NULL"),
+    ("receptions", "integer NOT NULL"),
+    ("receiving_yards", "integer NOT NULL"),
+    ("receiving_yards_per_reception", "real NOT NULL"),
+    ("receiving_touchdowns", "integer NOT NULL"),
+    ("plays_from_scrimmage", "integer NOT NULL"),
+    ("yards_from_scrimmage", "integer NOT NULL"),
+    ("yards_from_scrimmage_per_play", "real NOT NULL"),
+    ("rushing_and_receiving_touchdowns", "integer NOT NULL"),
+    ("solo_tackles", "integer NOT NULL"),
+    ("assists_on_tackles", "integer NOT NULL"),
+    ("total_tackles", "real NOT NULL"),
+    ("tackles_for_loss", "real NOT NULL"),
+    ("sacks", "real NOT NULL"),
+    ("interceptions", "integer NOT NULL"),
+    ("yards_returned_from_interceptions", "integer NOT NULL"),
+    ("yards_returned_per_interception", "real NOT NULL"),
+    ("interceptions_returned_for_touchdown", "integer NOT NULL"),
+    ("passes_defended", "integer NOT NULL"),
+    ("fumbles_recovered", "integer NOT NULL"),
+    ("yards_recovered_from_fumble", "integer NOT NULL"),
+    ("fumbles_recovered_for_touchdown", "integer NOT NULL"),
+    ("fumbles_forced", "integer NOT NULL"),
+    ("punt_return_touchdowns", "integer NOT NULL"),
+    ("kickoff_return_touchdowns", "integer NOT NULL"),
+    ("other_touchdowns", "integer NOT NULL"),
+    ("total_touchdowns", "integer NOT NULL"),
+    ("extra_points_made", "integer NOT NULL"),
+    ("field_goals_made", "integer NOT NULL"),
+    ("extra_points_attempted", "integer NOT NULL"),
+    ("extra_point_percentage", "real NOT NULL"),
+    ("field_goals_attempted", "integer NOT NULL"),
+    ("field_goal_percentage", "real NOT NULL"),
+    ("two_point_conversions", "integer NOT NULL"),
+    ("safeties", "integer NOT NULL"),
+    ("points", "integer NOT NULL"),
+    ("votes", "integer NOT NULL DEFAULT 0"),
+]
+
+
 def create_player_table(cursor):
+    # the table as migration 1 created it, frozen like the migration itself
     sql = """CREATE TABLE player(
             player_id varchar(50) NOT NULL,
             season integer NOT NULL,
@@ -82,7 +161,7 @@ def create_player_table(cursor):
             two_point_conversions integer NOT NULL,
             safeties integer NOT NULL,
             points integer NOT NULL,
-            votes int NOT NULL,
+            votes integer NOT NULL DEFAULT 0,
             PRIMARY KEY (player_id,season),
             CONSTRAINT fk_team
                     FOREIGN KEY(team_abbreviation, season) 
@@ -91,11 +170,184 @@ def create_player_table(cursor):
     cursor.execute(sql)
 
 
+# player_feature is the training/prediction view of the data: every player
+# column plus its team's, joined once. team_id and season would only repeat
+# the player's team_abbreviation and season so they're left out
+FEATURE_COLUMNS = PLAYER_COLUMNS + [
+    (name, definition)
+    for name, definition in TEAM_COLUMNS
+    if name not in ("team_id", "season")
+]
+
+
+def create_player_feature_table(cursor):
+    # the table as migration 5 created it, frozen like the migration itself
+    sql = """CREATE TABLE player_feature(
+            player_id varchar(50) NOT NULL,
+            season integer NOT NULL,
+            team_abbreviation varchar(30) NOT NULL,
+            position char(4) NOT NULL,
+            year varchar(4) NOT NULL,
+            games integer NOT NULL,
+            completed_passes integer NOT NULL,
+            pass_attempts integer NOT NULL,
+            passing_completion integer NOT NULL,
+            passing_yards integer NOT NULL,
+            passing_touchdowns integer NOT NULL,
+            interceptions_thrown integer NOT NULL,
+            passing_yards_per_attempt real NOT NULL,
+            adjusted_yards_per_attempt real NOT NULL,
+            quarterback_rating real NOT NULL,
+            rush_attempts integer NOT NULL,
+            rush_yards integer NOT NULL,
+            rush_yards_per_attempt real NOT NULL,
+            rush_touchdowns integer NOT NULL,
+            receptions integer NOT NULL,
+            receiving_yards integer NOT NULL,
+            receiving_yards_per_reception real NOT NULL,
+            receiving_touchdowns integer NOT NULL,
+            plays_from_scrimmage integer NOT NULL,
+            yards_from_scrimmage integer NOT NULL,
+            yards_from_scrimmage_per_play real NOT NULL,
+            rushing_and_receiving_touchdowns integer NOT NULL,
+            solo_tackles integer NOT NULL,
+            assists_on_tackles integer NOT NULL,
+            total_tackles real NOT NULL,
+            tackles_for_loss real NOT NULL,
+            sacks real NOT NULL,
+            interceptions integer NOT NULL,
+            yards_returned_from_interceptions integer NOT NULL,
+            yards_returned_per_interception real NOT NULL,
+            interceptions_returned_for_touchdown integer NOT NULL,
+            passes_defended integer NOT NULL,
+            fumbles_recovered integer NOT NULL,
+            yards_recovered_from_fumble integer NOT NULL,
+            fumbles_recovered_for_touchdown integer NOT NULL,
+            fumbles_forced integer NOT NULL,
+            punt_return_touchdowns integer NOT NULL,
+            kickoff_return_touchdowns integer NOT NULL,
+            other_touchdowns integer NOT NULL,
+            total_touchdowns integer NOT NULL,
+            extra_points_made integer NOT NULL,
+            field_goals_made integer NOT NULL,
+            extra_points_attempted integer NOT NULL,
+            extra_point_percentage real NOT NULL,
+            field_goals_attempted integer NOT NULL,
+            field_goal_percentage real NOT NULL,
+            two_point_conversions integer NOT NULL,
+            safeties integer NOT NULL,
+            points integer NOT NULL,
+            votes integer NOT NULL DEFAULT 0,
+            conference varchar(20) NOT NULL,
+            win_percentage real NOT NULL,
+            points_per_game real NOT NULL,
+            points_against_per_game real NOT NULL,
+            strength_of_schedule real NOT NULL,
+            simple_rating_system real NOT NULL,
+            PRIMARY KEY (player_id,season)
+          );"""
+    cursor.execute(sql)
+
+
+# integer surrogate keys (see keys.py), added to the tables by migration 6
+TEAM_KEY_COLUMNS = [("team_key", "integer"), ("conference_key", "integer")]
+PLAYER_KEY_COLUMNS = [("player_key", "integer"), ("team_key", "integer")]
+FEATURE_KEY_COLUMNS = [
+    ("player_key", "integer"),
+    ("team_key", "integer"),
+    ("conference_key", "integer"),
+]
+
+
+# player_feature's watermark: every refresh bumps it, so readers can tell the
+# table changed without scanning it (see experiments/snapshot.py)
+BUMP_FEATURE_VERSION = """UPDATE player_feature_version
+    SET version = version + 1, refreshed_at = CURRENT_TIMESTAMP;"""
+
+
+def refresh_player_features(cursor, seasons=None):
+    # rebuild player_feature for the given seasons (all of them by default)
+    # from the player/team join. the ingest scripts call this for the seasons
+    # they touched, so training and prediction never have to redo the join
+    player_columns = dict(PLAYER_COLUMNS + PLAYER_KEY_COLUMNS)
+    names = [name for name, _ in FEATURE_COLUMNS + FEATURE_KEY_COLUMNS]
+    column_list = ", ".join(names)
+    columns = ", ".join(
+        f"p.{name}" if name in player_columns else f"t.{name}" for name in names
+    )
+    updates = ",\n".join(
+        f"{name} = EXCLUDED.{name}"
+        for name in names
+        if name not in ("player_id", "season")
+    )
+    joined, stale = "WHERE true", ""
+    if seasons is not None:
+        joined = "WHERE p.season = ANY(%(seasons)s)"
+        stale = "f.season = ANY(%(seasons)s) AND"
+
+    params = {"seasons": list(seasons or [])}
+
+    if db.is_sqlite(cursor):
+        # no data-modifying CTEs, so clear and re-insert under a savepoint,
+        # which keeps the swap atomic and nests inside a migration's transaction
+        cleared = "" if seasons is None else "WHERE season = ANY(%(seasons)s)"
+        cursor.execute("SAVEPOINT refresh_player_features;")
+        try:
+            cursor.execute(f"DELETE FROM player_feature {cleared};", params)
+            cursor.execute(
+                f"""INSERT INTO player_feature ({column_list})
+                    SELECT {columns}
+                    FROM player p
+                    INNER JOIN team t
+                        ON p.team_key = t.team_key
+                        AND p.season = t.season
+                    {joined};""",
+                params,
+            )
+            rows = cursor.rowcount
+            cursor.execute(BUMP_FEATURE_VERSION)
+        except:
+            cursor.execute("ROLLBACK TO refresh_player_features;")
+            cursor.execute("RELEASE refresh_player_features;")
+            raise
+        cursor.execute("RELEASE refresh_player_features;")
+        return rows
+
+    # upsert the join, drop the rows that fell out of it and bump the version
+    # in one statement, so readers see either the old season or the new one,
+    # never a gap, and never new rows under the old version
+    cursor.execute(
+        f"""WITH fresh AS (
+                INSERT INTO player_feature ({column_list})
+                SELECT {columns}
+                FROM player p
+                INNER JOIN team t
+                    ON p.team_key = t.team_key
+                    AND p.season = t.season
+                {joined}
+                ON CONFLICT (player_id, season) DO UPDATE
+                SET {updates}
+                RETURNING player_id, season
+            ), stale AS (
+                DELETE FROM player_feature f
+                WHERE {stale} NOT EXISTS (
+                    SELECT 1 FROM fresh
+                    WHERE fresh.player_id = f.player_id AND fresh.season = f.season
+                )
+            ), bumped AS (
+                {BUMP_FEATURE_VERSION.rstrip(";")}
+            )
+            SELECT count(*) FROM fresh;""",
+        params,
+    )
+    return cursor.fetchone()[0]
+
+
 def create_prediction_table(cursor):
     sql = """CREATE TABLE prediction(
                 player_id varchar(50) NOT NULL,
                 team_id varchar(50) NOT NULL,
-                season float NOT NULL,
+                season integer NOT NULL,
                 projected_votes float NOT NULL,
                 PRIMARY KEY (player_id,season),
                 CONSTRAINT fk_player
@@ -190,25 +442,344 @@ def create_model_table(cursor):
     cursor.execute(sql)
 
 
-def main(cursor):
-    create_player_table(cursor)
+def create_checkpoint_table(cursor):
+    # see checkpoint.py. early ingest runs created this table themselves
+    sql = """CREATE TABLE IF NOT EXISTS ingest_checkpoint(
+                season integer NOT NULL,
+                conference varchar(20) NOT NULL,
+                team varchar(50) NOT NULL,
+                page_hash char(64) NOT NULL,
+                completed_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (season, conference, team)
+            );"""
+    cursor.execute(sql)
+
+
+def migration_initial_schema(cursor):
+    # team first, player and prediction reference it
     create_team_table(cursor)
+    create_player_table(cursor)
     create_prediction_table(cursor)
     create_model_table(cursor)
 
 
+def migration_ingest_bookkeeping(cursor):
+    # tables made before votes had a default, or before checkpointing existed.
+    # sqlite databases are newer than the default and can't alter it anyway
+    if not db.is_sqlite(cursor):
+        cursor.execute("ALTER TABLE player ALTER COLUMN votes SET DEFAULT 0;")
+    create_checkpoint_table(cursor)
+
+
+def migration_query_indexes(cursor):
+    # serves both the training join (player.team_abbreviation/season ->
+    # team's primary key) and the prediction run's season filter, neither of
+    # which can use player's (player_id, season) key
+    cursor.execute(
+        "CREATE INDEX player_season_team_idx ON player (season, team_abbreviation);"
+    )
+    # top-n model rankings in pick_best_model.ipynb
+    for metric in ("precision_avg", "recall_avg", "fscore_avg", "rmse_avg"):
+        cursor.execute(f"CREATE INDEX model_{metric}_idx ON model ({metric});")
+    # the api reads the whole prediction table, a sequential scan is already
+    # the best plan for that so it gets no extra index
+
+
+def migration_long_model_metrics(cursor):
+    # model keeps just the fitted artifacts, what was run and its averages
+    # move to a narrow summary table and the per-season metrics go long, so
+    # ranking runs never reads the pickles and new test seasons need no ddl
+    cursor.execute(
+        """CREATE TABLE model_summary(
+                model_id varchar(36) NOT NULL,
+                clf varchar(50) NOT NULL,
+                reg varchar(50) NOT NULL,
+                clf_params varchar(200) NOT NULL,
+                reg_params varchar(200) NOT NULL,
+                precision_avg float NOT NULL,
+                recall_avg float NOT NULL,
+                fscore_avg float NOT NULL,
+                rmse_avg float NOT NULL,
+                PRIMARY KEY (model_id),
+                CONSTRAINT fk_model
+                    FOREIGN KEY(model_id)
+                        REFERENCES model(model_id)
+            );"""
+    )
+    cursor.execute(
+        """CREATE TABLE model_metrics(
+                model_id varchar(36) NOT NULL,
+                season integer NOT NULL,
+                metric varchar(20) NOT NULL,
+                value float NOT NULL,
+                PRIMARY KEY (model_id, metric, season),
+                CONSTRAINT fk_model
+                    FOREIGN KEY(model_id)
+                        REFERENCES model(model_id)
+            );"""
+    )
+    for metric in ("precision_avg", "recall_avg", "fscore_avg", "rmse_avg"):
+        cursor.execute(
+            f"CREATE INDEX model_summary_{metric}_idx ON model_summary ({metric});"
+        )
+
+    # carry over every run already in the wide table
+    cursor.execute(
+        """INSERT INTO model_summary
+            SELECT model_id, clf, reg, clf_params, reg_params,
+                precision_avg, recall_avg, fscore_avg, rmse_avg
+            FROM model;"""
+    )
+    wide_columns = [
+        (season, metric)
+        for season in range(2006, 2022)
+        for metric in ("precision", "recall", "fscore", "rmse")
+    ]
+    values = ",\n".join(
+        f"({season}, '{metric}', m.{metric}_{season})"
+        for season, metric in wide_columns
+    )
+    dropped = ["clf", "reg", "clf_params", "reg_params"]
+    dropped += ["precision_avg", "recall_avg", "fscore_avg", "rmse_avg"]
+    dropped += [f"{metric}_{season}" for season, metric in wide_columns]
+
+    if db.is_sqlite(cursor):
+        # no lateral joins, and columns go one at a time once nothing indexes them
+        for season, metric in wide_columns:
+            cursor.execute(
+                f"""INSERT INTO model_metrics (model_id, season, metric, value)
+                    SELECT model_id, {season}, '{metric}', {metric}_{season}
+                    FROM model;"""
+            )
+        for metric in ("precision_avg", "recall_avg", "fscore_avg", "rmse_avg"):
+            cursor.execute(f"DROP INDEX model_{metric}_idx;")
+        for column in dropped:
+            cursor.execute(f"ALTER TABLE model DROP COLUMN {column};")
+        return
+
+    cursor.execute(
+        f"""INSERT INTO model_metrics (model_id, season, metric, value)
+            SELECT m.model_id, v.season, v.metric, v.value
+            FROM model m
+            CROSS JOIN LATERAL (VALUES {values}) AS v(season, metric, value);"""
+    )
+    cursor.execute(
+        "ALTER TABLE model "
+        + ", ".join(f"DROP COLUMN {column}" for column in dropped)
+        + ";"
+    )
+
+
+def migration_player_feature(cursor):
+    # filled in by refresh_player_features after each ingest, backfilled here from
+    # whatever's already been scraped
+    create_player_feature_table(cursor)
+    cursor.execute("CREATE INDEX player_feature_season_idx ON player_feature (season);")
+    # the join as it stood when this shipped, refresh_player_features has
+    # since moved to the surrogate keys that only exist from migration 6 on.
+    # player has exactly the columns player_feature starts with at this point
+    cursor.execute(
+        """INSERT INTO player_feature
+            SELECT p.*, t.conference, t.win_percentage, t.points_per_game,
+                t.points_against_per_game, t.strength_of_schedule,
+                t.simple_rating_system
+            FROM player p
+            INNER JOIN team t
+                ON p.team_abbreviation = t.team_id
+                AND p.season = t.season;"""
+    )
+
+
+def create_lookup_table(cursor, table, key, natural):
+    if db.is_sqlite(cursor):
+        # an INTEGER PRIMARY KEY is sqlite's rowid, numbered automatically
+        key_definition = "INTEGER PRIMARY KEY"
+    else:
+        key_definition = "integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"
+    cursor.execute(
+        f"""CREATE TABLE {table}(
+                {key} {key_definition},
+                {natural} varchar(50) NOT NULL UNIQUE
+            );"""
+    )
+
+
+def migration_surrogate_keys(cursor):
+    # integer keys for teams, conferences and players next to the natural
+    # ids. the natural ids stay, they're what the site, the ballots and the
+    # api speak, but joins and the feature table go through the keys
+    # the lookup tables as keys.LOOKUPS had them when this shipped, frozen
+    for table, key, natural in [
+        ("team_lookup", "team_key", "team_id"),
+        ("conference_lookup", "conference_key", "conference"),
+        ("player_lookup", "player_key", "player_id"),
+    ]:
+        create_lookup_table(cursor, table, key, natural)
+    # one column at a time, sqlite can't add several in one statement
+    for table, name in [
+        ("team", "team_key"),
+        ("team", "conference_key"),
+        ("player", "player_key"),
+        ("player", "team_key"),
+        ("player_feature", "player_key"),
+        ("player_feature", "team_key"),
+        ("player_feature", "conference_key"),
+    ]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} integer;")
+    cursor.execute(
+        "CREATE UNIQUE INDEX team_key_season_idx ON team (team_key, season);"
+    )
+    cursor.execute("CREATE INDEX player_team_key_idx ON player (season, team_key);")
+
+    # the renames crawl.normalize_team_id applies, was a dict in crawl.py
+    cursor.execute(
+        """CREATE TABLE team_alias(
+                alias varchar(50) NOT NULL,
+                team_id varchar(50) NOT NULL,
+                PRIMARY KEY (alias)
+            );"""
+    )
+    cursor.execute(
+        """INSERT INTO team_alias (alias, team_id) VALUES
+            ('LOUISIANA-STATE', 'LSU'),
+            ('MISSISSIPPI', 'OLE-MISS'),
+            ('SOUTHERN-CALIFORNIA', 'USC'),
+            ('PITTSBURGH', 'PITT'),
+            ('TEXAS-CHRISTIAN', 'TCU');"""
+    )
+
+    # key every row already loaded, what keys.assign did for all seasons when
+    # this shipped, frozen. the WHERE is there so sqlite can tell ON CONFLICT
+    # from a join
+    for lookup, natural, source in [
+        ("team_lookup", "team_id", "team"),
+        ("conference_lookup", "conference", "team"),
+        ("player_lookup", "player_id", "player"),
+    ]:
+        cursor.execute(
+            f"""INSERT INTO {lookup} ({natural})
+                SELECT DISTINCT {natural} FROM {source}
+                WHERE true
+                ON CONFLICT ({natural}) DO NOTHING;"""
+        )
+    cursor.execute(
+        """UPDATE team AS t
+            SET team_key = l.team_key, conference_key = c.conference_key
+            FROM team_lookup l, conference_lookup c
+            WHERE l.team_id = t.team_id AND c.conference = t.conference;"""
+    )
+    cursor.execute(
+        """UPDATE player AS p
+            SET player_key = l.player_key, team_key = k.team_key
+            FROM player_lookup l, team_lookup k
+            WHERE l.player_id = p.player_id AND k.team_id = p.team_abbreviation;"""
+    )
+
+    # player_feature was backfilled by migration 5, re-joining it on the keys
+    # only has to carry them over
+    cursor.execute(
+        """UPDATE player_feature AS f
+            SET player_key = p.player_key,
+                team_key = p.team_key,
+                conference_key = t.conference_key
+            FROM player p
+            INNER JOIN team t
+                ON p.team_key = t.team_key
+                AND p.season = t.season
+            WHERE p.player_id = f.player_id AND p.season = f.season;"""
+    )
+
+
+def migration_model_encoder(cursor):
+    # the fitted feature encoder (experiments/features.py) pickled next to the
+    # models it encodes for. runs from before it have none
+    cursor.execute("ALTER TABLE model ADD COLUMN encoder_object bytea;")
+
+
+def migration_feature_version(cursor):
+    # a single row, bumped by refresh_player_features. it starts after the
+    # backfills of migrations 5 and 6
+    cursor.execute(
+        """CREATE TABLE player_feature_version(
+                version integer NOT NULL,
+                refreshed_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );"""
+    )
+    cursor.execute("INSERT INTO player_feature_version (version) VALUES (1);")
+
+
+# numbered schema changes, applied in order and recorded in schema_migrations.
+# never edit a migration that has shipped, add a new one instead
+MIGRATIONS = [
+    (1, "initial schema", migration_initial_schema),
+    (2, "ingest bookkeeping", migration_ingest_bookkeeping),
+    (3, "query indexes", migration_query_indexes),
+    (4, "long model metrics", migration_long_model_metrics),
+    (5, "player feature table", migration_player_feature),
+    (6, "surrogate keys", migration_surrogate_keys),
+    (7, "model encoder", migration_model_encoder),
+    (8, "player feature version", migration_feature_version),
+]
+
+
+def get_applied_migrations(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations(
+                version integer NOT NULL,
+                name varchar(100) NOT NULL,
+                applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (version)
+            );"""
+    )
+    cursor.execute("SELECT version FROM schema_migrations;")
+    applied = {row[0] for row in cursor.fetchall()}
+
+    # databases built before migrations existed already have the initial schema
+    if db.is_sqlite(cursor):
+        cursor.execute("SELECT count(*) > 0 FROM sqlite_master WHERE name = 'player';")
+    else:
+        cursor.execute("SELECT to_regclass('player') IS NOT NULL;")
+    if not applied and cursor.fetchone()[0]:
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (1, 'initial schema');"
+        )
+        applied.add(1)
+
+    return applied
+
+
+def migrate(cursor):
+    applied = get_applied_migrations(cursor)
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+
+        # each migration runs in its own transaction, postgres ddl is
+        # transactional so a failed migration leaves nothing half-applied
+        cursor.execute("BEGIN;")
+        try:
+            migration(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                (version, name),
+            )
+        except:
+            cursor.execute("ROLLBACK;")
+            raise
+        cursor.execute("COMMIT;")
+        print(f"Applied migration {version}: {name}")
+
+
+def main(cursor):
+    migrate(cursor)
+
+
 if __name__ == "__main__":
 
     config = get_settings()
 
     # connection establishment
-    conn = psycopg2.connect(
-        database=config["db"]["database"],
-        user=config["db"]["user"],
-        password=config["db"]["password"],
-        host=config["db"]["host"],
-    )
-    conn.autocommit = True
+    conn = db.connect(config)
     cursor = conn.cursor()
 
     main(cursor)
@@ -0,0 +1,161 @@
+import csv
+import io
+import db
+
+
+# bulk loading for the ingest scripts. rows are streamed into an unlogged
+# staging copy of the target table with COPY, then each season is merged
+# into the real table with a single upsert generated from the table's
+# primary key, so there are no hand-maintained column lists to drift. on
+# the sqlite backend the same steps run as plain inserts
+
+
+def copy_rows(cursor, table, columns, rows):
+    # rows are sequences in the same order as columns
+    if db.is_sqlite(cursor):
+        # one transaction for the batch, in autocommit every row would be
+        # its own commit
+        placeholders = ",".join("%s" for _ in columns)
+        cursor.execute("BEGIN;")
+        try:
+            cursor.executemany(
+                f"INSERT INTO {table} ({','.join(columns)}) VALUES ({placeholders})",
+                rows,
+            )
+        except:
+            cursor.execute("ROLLBACK;")
+            raise
+        cursor.execute("COMMIT;")
+        return
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({','.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+
+def get_integer_columns(cursor, table):
+    if db.is_sqlite(cursor):
+        # sqlite gives a column integer affinity when its type contains "INT"
+        cursor.execute(f"PRAGMA table_info({table});")
+        return {row[1] for row in cursor.fetchall() if "INT" in row[2].upper()}
+
+    cursor.execute(
+        """SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = %s
+                AND table_schema = ANY(current_schemas(false))
+                AND data_type IN ('smallint', 'integer', 'bigint');""",
+        (table,),
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def get_primary_key(cursor, table):
+    if db.is_sqlite(cursor):
+        cursor.execute(f"PRAGMA table_info({table});")
+        key = sorted((row[5], row[1]) for row in cursor.fetchall() if row[5])
+        return [name for _, name in key]
+
+    cursor.execute(
+        """SELECT a.attname
+            FROM pg_index i
+            JOIN pg_attribute a
+                ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND i.indisprimary
+            ORDER BY array_position(i.indkey::int2[], a.attnum);""",
+        (table,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def prepare(cursor, table, seasons):
+    # throw away anything a previous, interrupted run left staged for these
+    # seasons so it can't be merged in alongside fresh rows
+    if db.is_sqlite(cursor):
+        # an empty copy of the table's columns, defaults come from the table
+        # itself since merge only inserts the staged columns
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS staging_{table}
+                    AS SELECT * FROM {table} WHERE false;"""
+        )
+    else:
+        cursor.execute(
+            f"""CREATE UNLOGGED TABLE IF NOT EXISTS staging_{table}
+                    (LIKE {table} INCLUDING DEFAULTS);"""
+        )
+    cursor.execute(
+        f"DELETE FROM staging_{table} WHERE season = ANY(%s);", (list(seasons),)
+    )
+
+
+def stage(cursor, table, columns, rows):
+    # rows are dicts keyed by column name. sportsipy hands back floats like
+    # 53.3 for some integer columns: COPY rejects them and sqlite would store
+    # them as they are, so round them here and both backends agree
+    integers = get_integer_columns(cursor, f"staging_{table}")
+    rows = (
+        {
+            column: round(value)
+            if column in integers and isinstance(value, float)
+            else value
+            for column, value in row.items()
+        }
+        for row in rows
+    )
+    copy_rows(
+        cursor,
+        f"staging_{table}",
+        columns,
+        ([row[column] for column in columns] for row in rows),
+    )
+
+
+def merge(cursor, table, columns, season):
+    key = get_primary_key(cursor, table)
+    key_columns = ",".join(key)
+    column_list = ",".join(columns)
+    updates = ",\n".join(
+        f"{column} = EXCLUDED.{column}" for column in columns if column not in key
+    )
+
+    if db.is_sqlite(cursor):
+        # no data-modifying CTEs in sqlite, so the upsert and the drain share
+        # a transaction instead. sqlite lets a later staged duplicate update
+        # the row an earlier one inserted, which stands in for DISTINCT ON
+        cursor.execute("BEGIN;")
+        cursor.execute(
+            f"""INSERT INTO {table} ({column_list})
+                SELECT {column_list}
+                FROM staging_{table}
+                WHERE season = %s
+                ON CONFLICT ({key_columns}) DO UPDATE
+                SET {updates};""",
+            (season,),
+        )
+        rows = cursor.rowcount
+        cursor.execute(f"DELETE FROM staging_{table} WHERE season = %s;", (season,))
+        cursor.execute("COMMIT;")
+        return rows
+
+    # drain the season out of staging and upsert it in one statement. DISTINCT
+    # ON keeps a player listed on two rosters from hitting the same row twice
+    cursor.execute(
+        f"""WITH staged AS (
+                DELETE FROM staging_{table}
+                WHERE season = %s
+                RETURNING {column_list}
+            )
+            INSERT INTO {table} ({column_list})
+            SELECT DISTINCT ON ({key_columns}) {column_list}
+            FROM staged
+            ORDER BY {key_columns}
+            ON CONFLICT ({key_columns}) DO UPDATE
+            SET {updates};""",
+        (season,),
+    )
+    cursor.connection.commit()
+
+    return cursor.rowcount
@@ -0,0 +1,35 @@
+import hashlib
+import requests
+
+
+# completed (season, conference, team) units of a crawl, with the hash of the
+# team page they were scraped from. a rerun skips every unit whose page is
+# unchanged, so an interrupted backfill picks up where it died and a weekly
+# refresh only re-scrapes the teams that actually changed. the table itself
+# is created by build_db's migrations
+def load(cursor, seasons):
+    cursor.execute(
+        """SELECT season, conference, team, page_hash
+            FROM ingest_checkpoint
+            WHERE season = ANY(%s);""",
+        (list(seasons),),
+    )
+    return {(season, conf, team): h for season, conf, team, h in cursor.fetchall()}
+
+
+def record(cursor, units):
+    # units are (season, conference, team, page_hash) tuples
+    for unit in units:
+        cursor.execute(
+            """INSERT INTO ingest_checkpoint (season, conference, team, page_hash)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (season, conference, team) DO UPDATE
+                SET page_hash = EXCLUDED.page_hash, completed_at = CURRENT_TIMESTAMP;""",
+            unit,
+        )
+    cursor.connection.commit()
+
+
+def page_hash(url):
+    # goes through the page cache, so for past seasons this never hits the network
+    return hashlib.sha256(requests.get(url).content).hexdigest()
@@ -0,0 +1,281 @@
+from collections import Counter, defaultdict
+import queue
+import threading
+import time
+from sportsipy.ncaaf.teams import Team
+from sportsipy.ncaaf.conferences import Conference
+from sportsipy.ncaaf.constants import ROSTER_URL
+import bulk_load
+import metrics
+import checkpoint
+import page_cache
+import keys
+from build_db import PLAYER_COLUMNS, TEAM_COLUMNS
+
+
+# one crawl for both tables: each season's team list is resolved once, each
+# team page is pulled once, and that single pass emits the team row and the
+# roster rows so the player -> team join keys always agree
+TEAM_COLUMN_NAMES = [name for name, _ in TEAM_COLUMNS]
+
+# every player column except votes comes straight off the sportsipy player,
+# votes are filled in afterwards by get_heisman_votes_data
+PAGE_COLUMNS = [name for name, _ in PLAYER_COLUMNS if name != "votes"]
+
+COLUMNS = {"team": TEAM_COLUMN_NAMES, "player": PAGE_COLUMNS}
+KEYS = {"team": ("team_id", "season"), "player": ("player_id", "season")}
+
+# bounded queues between the pipeline stages
+UNIT_QUEUE_SIZE = 16
+EVENT_QUEUE_SIZE = 2000
+BATCH_SIZE = 1000
+
+# sports-reference's school slugs vs the names on player pages, loaded from
+# the team_alias table at the start of each run
+team_aliases = {}
+
+
+def normalize_team_id(team_abbrev):
+    # team name preprocessing
+    team_abbrev = team_abbrev.replace(" ", "-")
+    team_abbrev = team_abbrev.replace("(", "").replace(")", "").replace("&", "")
+    team_abbrev = team_abbrev.upper()
+    return team_aliases.get(team_abbrev, team_abbrev)
+
+
+def get_season_conferences(year):
+    power_5 = ["big-12", "acc", "big-ten", "sec", "pac-12", "big-east", "independents"]
+    confs = []
+
+    # conferences in the power 5
+    for conf in power_5:
+        if conf == "pac-12" and year < 2011:
+            conf = "pac-10"
+        if conf == "big-east" and year > 2012:
+            continue
+        confs.append(conf)
+
+    return confs
+
+
+def get_conference_teams(conf, year):
+    # some nonsense for independents schools
+    # BYU only relevant ind. team in 2020 (Notre Dame temporarily joined the ACC)
+    # Notre Dame & BYU independents from 2011 on (minus 2020)
+    # Only Notre Dame prior to 2011
+    if conf == "independents" and year == 2020:
+        return ["brigham-young"]
+    elif conf == "independents" and year > 2010:
+        return ["notre-dame", "brigham-young"]
+    elif conf == "independents":
+        return ["notre-dame"]
+
+    conference = Conference(conf, str(year))
+    return list(conference.teams.keys())
+
+
+def get_team_row(team, team_id, year):
+    d = {
+        "team_id": team_id,
+        "season": str(year),
+        "conference": team.conference,
+        "win_percentage": team.win_percentage,
+        "points_per_game": team.points_per_game,
+        "points_against_per_game": team.points_against_per_game,
+        "strength_of_schedule": team.strength_of_schedule,
+        "simple_rating_system": team.simple_rating_system,
+    }
+    # replace nulls with zeros
+    return {k: v or 0 for (k, v) in d.items()}
+
+
+def get_season_stats(player, team_id, year):
+    # resolve the season view once and read every column off it in one pass,
+    # each player(str(year)) call re-scans the player's seasons
+    season_stats = player(str(year))
+    if season_stats.season == "Career":
+        return None
+
+    d = {column: getattr(season_stats, column) for column in PAGE_COLUMNS}
+    # the roster we found the player on is the team they played for that year
+    d["team_abbreviation"] = team_id
+
+    # replace nulls with zeros
+    return {k: v or 0 for (k, v) in d.items()}
+
+
+def crawl_team(key, year, known_hash=None, with_players=True):
+    # streams ("team", row) and ("player", row) as the team's pages are parsed,
+    # then a closing ("unit", (page_hash, scraped)). scraped is False when the
+    # roster wasn't pulled (unchanged or not asked for)
+    team = Team(key.upper(), year=str(year))
+    team_id = normalize_team_id(team.abbreviation)
+    try:
+        team_row = get_team_row(team, team_id, year)
+    except:
+        # without a team row its players would break fk_team, skip the unit
+        metrics.count("teams_dropped")
+        yield "unit", (None, False)
+        return
+    yield "team", team_row
+
+    if not with_players:
+        yield "unit", (None, False)
+        return
+
+    # the roster page decides whether the team changed since it was last
+    # scraped, if not there's no need to pull any of its player pages
+    page_hash = checkpoint.page_hash(ROSTER_URL % (key.lower(), year))
+    if page_hash == known_hash:
+        yield "unit", (page_hash, False)
+        return
+
+    # pulling the roster is where sportsipy downloads every player page
+    with metrics.timer("roster_fetch"):
+        roster = team.roster.players
+
+    # go through each player on the roster
+    parse_seconds = 0
+    for player in roster:
+        start = time.perf_counter()
+        try:
+            d = get_season_stats(player, team_id, year)
+        except:
+            metrics.count("players_dropped")
+            continue
+        finally:
+            parse_seconds += time.perf_counter() - start
+        if d is not None:
+            metrics.count("players_parsed")
+            yield "player", d
+    metrics.record("team_parse", parse_seconds)
+
+    yield "unit", (page_hash, True)
+
+
+def plan_units(years, completed, units, events, workers):
+    # planner stage: resolves each season's team list and feeds the fetchers,
+    # then tells the writer how many units the season has
+    try:
+        for year in years:
+            count = 0
+            for conf in get_season_conferences(year):
+                # go through each team in the conference
+                for key in get_conference_teams(conf, year):
+                    units.put((year, conf, key, completed.get((year, conf, key))))
+                    count += 1
+            events.put(("planned", year, count))
+    except Exception as e:
+        events.put(("error", None, e))
+    finally:
+        for _ in range(workers):
+            units.put(None)
+
+
+def fetch_units(units, events, with_players):
+    # fetch/parse stage: one of these per worker thread
+    try:
+        while (unit := units.get()) is not None:
+            year, conf, key, known_hash = unit
+            start = time.perf_counter()
+            with page_cache.crawling_season(year):
+                for kind, payload in crawl_team(key, year, known_hash, with_players):
+                    events.put((kind, (year, conf, key), payload))
+            metrics.record("team_crawl", time.perf_counter() - start)
+    except Exception as e:
+        events.put(("error", None, e))
+    finally:
+        events.put(("stopped", None, None))
+
+
+def run(cursor, years=range(2000, 2022), workers=1, resume=True, with_players=True):
+    # planner -> fetchers -> this thread, which dedupes rows on their primary
+    # key, stages them in batches and merges each season into team, then
+    # player, once its last unit is in. the queues are bounded so memory stays
+    # flat and a slow db pushes back on the fetchers instead of piling up rows
+    team_aliases.update(keys.load_aliases(cursor))
+    bulk_load.prepare(cursor, "team", years)
+    completed = {}
+    if with_players:
+        bulk_load.prepare(cursor, "player", years)
+        if resume:
+            completed = checkpoint.load(cursor, years)
+
+    units = queue.Queue(maxsize=UNIT_QUEUE_SIZE)
+    events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    threads = [
+        threading.Thread(
+            target=plan_units, args=(years, completed, units, events, workers)
+        )
+    ] + [
+        threading.Thread(target=fetch_units, args=(units, events, with_players))
+        for _ in range(workers)
+    ]
+    for thread in threads:
+        # daemon so a failed run doesn't hang on fetchers blocked on a full queue
+        thread.daemon = True
+        thread.start()
+
+    batches = {"team": [], "player": []}
+    seen = defaultdict(set)
+    planned = {}
+    finished = Counter()
+    scraped = defaultdict(list)
+
+    def flush(table):
+        if batches[table]:
+            with metrics.timer(f"{table}_write"):
+                bulk_load.stage(cursor, table, COLUMNS[table], batches[table])
+            batches[table] = []
+
+    running = workers
+    while running:
+        kind, unit, payload = events.get()
+        if kind == "error":
+            raise payload
+        elif kind == "stopped":
+            running -= 1
+            continue
+        elif kind == "planned":
+            year = unit
+            planned[year] = payload
+        elif kind in ("team", "player"):
+            # dedupe on the primary key, a player listed on two rosters is
+            # only written once
+            row_key = tuple(payload[column] for column in KEYS[kind])
+            if row_key not in seen[kind, unit[0]]:
+                seen[kind, unit[0]].add(row_key)
+                batches[kind].append(payload)
+                if len(batches[kind]) >= BATCH_SIZE:
+                    flush(kind)
+            continue
+        else:
+            year, conf, key = unit
+            page_hash, was_scraped = payload
+            finished[year] += 1
+            metrics.count("units_scraped" if was_scraped else "units_skipped")
+            if was_scraped:
+                scraped[year].append((year, conf, key, page_hash))
+                print(f"Scraped team {key} in conference {conf} in year {year}")
+            elif with_players:
+                print(f"Skipped roster {key} in conference {conf} in year {year}")
+
+        if planned.get(year) == finished[year]:
+            # the season is complete: flush what's batched and merge it
+            flush("team")
+            flush("player")
+            with metrics.timer("team_write"):
+                rows = bulk_load.merge(cursor, "team", COLUMNS["team"], year)
+            metrics.count("team_rows_written", rows)
+            print(f"Wrote {rows} teams to db for year {year}")
+            if scraped[year]:
+                with metrics.timer("player_write"):
+                    rows = bulk_load.merge(cursor, "player", COLUMNS["player"], year)
+                metrics.count("player_rows_written", rows)
+                # a team only counts as done once its rows are merged
+                checkpoint.record(cursor, scraped.pop(year))
+                print(f"Wrote {rows} players to db for year {year}")
+            keys.assign(cursor, [year])
+            del planned[year]
+            seen.pop(("team", year), None)
+            seen.pop(("player", year), None)
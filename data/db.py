@@ -0,0 +1,117 @@
+import json
+import re
+import sqlite3
+from pathlib import Path
+import psycopg2
+
+
+# the database backend, picked with db.backend in config.yml. "postgres" (the
+# default) uses the db connection settings, "sqlite" keeps everything in the
+# file at db.path so the whole ingest -> train -> predict -> serve loop runs
+# locally without a server:
+#
+#   db:
+#     backend: sqlite
+#     path: heisman.db
+ROOT = Path(__file__).parent.joinpath("..").resolve()
+
+
+def get_backend(config):
+    return config["db"].get("backend", "postgres")
+
+
+def get_sqlite_path(config):
+    # relative paths are relative to the repo root, like config.yml itself
+    return ROOT.joinpath(config["db"].get("path") or "heisman.db")
+
+
+def get_url(config):
+    # sqlalchemy url for the experiments and the api
+    if get_backend(config) == "sqlite":
+        return f"sqlite:///{get_sqlite_path(config)}"
+
+    database = config["db"]["database"]
+    user = config["db"]["user"]
+    password = config["db"]["password"]
+    host = config["db"]["host"]
+    return f"postgresql+psycopg2://{user}:{password}@{host}/{database}"
+
+
+def connect(config):
+    # an autocommit connection, the scripts manage their own transactions
+    if get_backend(config) == "sqlite":
+        conn = sqlite3.connect(get_sqlite_path(config), isolation_level=None)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA journal_mode = WAL;")
+        return SqliteConnection(conn)
+
+    conn = psycopg2.connect(
+        database=config["db"]["database"],
+        user=config["db"]["user"],
+        password=config["db"]["password"],
+        host=config["db"]["host"],
+    )
+    conn.autocommit = True
+    return conn
+
+
+def is_sqlite(cursor):
+    return isinstance(cursor, SqliteCursor)
+
+
+class SqliteConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return SqliteCursor(self, self.conn.cursor())
+
+    def commit(self):
+        # autocommit, explicit transactions are committed by their COMMIT
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+class SqliteCursor:
+    # takes the psycopg2 paramstyle the shared queries are written in, so only
+    # statements postgres and sqlite disagree on need a sqlite branch.
+    # "= ANY(%s)" with a list becomes an IN over the list sent as json
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    def translate(self, sql, params):
+        if isinstance(params, dict):
+            params = {
+                k: json.dumps(list(v)) if isinstance(v, (list, range)) else v
+                for k, v in params.items()
+            }
+            sql = re.sub(
+                r"= ANY\(%\((\w+)\)s\)", r"IN (SELECT value FROM json_each(:\1))", sql
+            )
+            sql = re.sub(r"%\((\w+)\)s", r":\1", sql)
+        elif params is not None:
+            params = [
+                json.dumps(list(v)) if isinstance(v, (list, range)) else v
+                for v in params
+            ]
+            sql = sql.replace("= ANY(%s)", "IN (SELECT value FROM json_each(%s))")
+            sql = sql.replace("%s", "?")
+        return sql, params
+
+    def execute(self, sql, params=None):
+        sql, params = self.translate(sql, params)
+        if params is None:
+            self.cursor.execute(sql)
+        else:
+            self.cursor.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        sql, _ = self.translate(sql, ())
+        self.cursor.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        # fetchone, fetchall, rowcount, ...
+        return getattr(self.cursor, name)
@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+import page_cache
+import metrics
+
+
+# shared HTTP layer for the scrapers. sportsipy pulls every page through
+# requests (pyquery calls requests.get under the hood), as does our own votes
+# scraper, so patching Session.request gives one place to throttle and retry
+# (and cache) every fetch without touching sportsipy itself
+settings = {
+    # sports-reference blocks clients that go over ~20 requests a minute
+    "min_interval": 3.0,
+    "retries": 5,
+    "backoff": 2.0,
+    # origin -> replacement, to point the scrapers at a local stand-in server
+    "base_urls": {},
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_original_request = requests.sessions.Session.request
+_next_slot = {}
+_slot_lock = threading.Lock()
+
+
+def wait_for_slot(host):
+    # reserve the next free slot for this host, then sleep until it comes up.
+    # the lock is only held while booking so other hosts/threads aren't blocked
+    with _slot_lock:
+        now = time.monotonic()
+        slot = max(now, _next_slot.get(host, now))
+        _next_slot[host] = slot + settings["min_interval"]
+    time.sleep(slot - now)
+
+
+def backoff_delay(attempt, response=None):
+    # honour Retry-After on a 429, otherwise exponential backoff with jitter
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return int(response.headers["Retry-After"])
+    return settings["backoff"] * 2**attempt + random.uniform(0, 1)
+
+
+def rewrite(url):
+    for origin, replacement in settings["base_urls"].items():
+        if url.startswith(origin):
+            return replacement + url[len(origin) :]
+    return url
+
+
+def request(session, method, url, **kwargs):
+    params = kwargs.get("params")
+    cached = page_cache.lookup(method, url, params)
+    if cached is not None:
+        metrics.count("pages_from_cache")
+        return cached
+    if page_cache.settings["offline"]:
+        metrics.count("offline_cache_misses")
+        raise page_cache.OfflineCacheMiss(
+            f"{method} {page_cache.full_url(url, params)} is not in the page cache"
+        )
+
+    response = request_with_retries(session, method, url, **kwargs)
+    metrics.count("pages_fetched")
+    metrics.count("bytes_downloaded", len(response.content))
+    page_cache.store(method, url, response, params)
+    return response
+
+
+def request_with_retries(session, method, url, **kwargs):
+    # the cache is keyed on the original url, only the network call is redirected
+    url = rewrite(url)
+    host = urlparse(url).netloc
+    retries = settings["retries"]
+
+    for attempt in range(retries + 1):
+        wait_for_slot(host)
+        start = time.perf_counter()
+        try:
+            response = _original_request(session, method, url, **kwargs)
+            metrics.record("fetch_latency", time.perf_counter() - start)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            response = None
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+
+        metrics.count("fetch_retries")
+        time.sleep(backoff_delay(attempt, response))
+
+
+def install(config, offline=False):
+    # both sections of config.yml are optional, the defaults are fine for a backfill
+    settings.update(config.get("fetch") or {})
+    page_cache.settings.update(config.get("cache") or {})
+    if offline:
+        page_cache.settings["offline"] = True
+    requests.sessions.Session.request = request
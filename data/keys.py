@@ -0,0 +1,53 @@
+# integer surrogate keys for teams, conferences and players. each lookup
+# table hands out one key per natural id the first time it's seen, and the
+# team/player rows carry the keys next to their natural ids so joins and
+# the feature table work on integers. the tables are created by build_db's
+# migrations
+LOOKUPS = [
+    # (lookup table, key column, natural column, source table)
+    ("team_lookup", "team_key", "team_id", "team"),
+    ("conference_lookup", "conference_key", "conference", "team"),
+    ("player_lookup", "player_key", "player_id", "player"),
+]
+
+
+def assign(cursor, seasons=None):
+    # hand out keys for any new ids in the given seasons (all of them by
+    # default) and stamp them onto that season's team and player rows
+    def in_seasons(column):
+        return "" if seasons is None else f"AND {column} = ANY(%(seasons)s)"
+
+    params = {"seasons": list(seasons or [])}
+
+    for lookup, _, natural, source in LOOKUPS:
+        # the WHERE is always there so sqlite can tell ON CONFLICT from a join
+        cursor.execute(
+            f"""INSERT INTO {lookup} ({natural})
+                SELECT DISTINCT {natural} FROM {source}
+                WHERE true {in_seasons("season")}
+                ON CONFLICT ({natural}) DO NOTHING;""",
+            params,
+        )
+
+    cursor.execute(
+        f"""UPDATE team AS t
+            SET team_key = l.team_key, conference_key = c.conference_key
+            FROM team_lookup l, conference_lookup c
+            WHERE l.team_id = t.team_id AND c.conference = t.conference
+            {in_seasons("t.season")};""",
+        params,
+    )
+    cursor.execute(
+        f"""UPDATE player AS p
+            SET player_key = l.player_key, team_key = k.team_key
+            FROM player_lookup l, team_lookup k
+            WHERE l.player_id = p.player_id AND k.team_id = p.team_abbreviation
+            {in_seasons("p.season")};""",
+        params,
+    )
+
+
+def load_aliases(cursor):
+    # sports-reference's school slugs vs the names on player pages
+    cursor.execute("SELECT alias, team_id FROM team_alias;")
+    return dict(cursor.fetchall())
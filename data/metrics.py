@@ -0,0 +1,101 @@
+import csv
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# per-stage ingest metrics. counters and timings are collected from every
+# thread of a run and written out once at the end, so we can see where
+# backfill time goes and compare runs
+_lock = threading.Lock()
+counters = defaultdict(int)
+timings = defaultdict(list)
+started_at = time.time()
+
+
+def reset():
+    global started_at
+    with _lock:
+        counters.clear()
+        timings.clear()
+        started_at = time.time()
+
+
+def count(name, n=1):
+    with _lock:
+        counters[name] += n
+
+
+def record(name, seconds):
+    with _lock:
+        timings[name].append(seconds)
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def percentile(values, q):
+    # nearest-rank percentile, values must be sorted
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize():
+    stages = {}
+    for name, values in timings.items():
+        values = sorted(values)
+        stages[name] = {
+            "count": len(values),
+            "total_seconds": sum(values),
+            "mean_seconds": sum(values) / len(values),
+            "p50_seconds": percentile(values, 50),
+            "p90_seconds": percentile(values, 90),
+            "p99_seconds": percentile(values, 99),
+            "max_seconds": values[-1],
+        }
+
+    # throughput of the db writes, per table
+    rates = {}
+    for table in ("team", "player", "votes"):
+        write_seconds = sum(timings.get(f"{table}_write", []))
+        if write_seconds:
+            rates[f"{table}_rows_per_second"] = (
+                counters[f"{table}_rows_written"] / write_seconds
+            )
+
+    return {
+        "wall_seconds": time.time() - started_at,
+        "counters": dict(counters),
+        "timings": stages,
+        "rates": rates,
+    }
+
+
+def write_report(path):
+    summary = summarize()
+    if str(path).endswith(".csv"):
+        # one flat metric per row so reports from different runs can be diffed
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["metric", "value"])
+            writer.writerow(["wall_seconds", summary["wall_seconds"]])
+            for name, value in summary["counters"].items():
+                writer.writerow([name, value])
+            for name, stats in summary["timings"].items():
+                for stat, value in stats.items():
+                    writer.writerow([f"{name}.{stat}", value])
+            for name, value in summary["rates"].items():
+                writer.writerow([name, value])
+    else:
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    return summary
@@ -0,0 +1,169 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+import requests
+
+
+# on-disk response cache shared by every scraper. bodies are stored gzipped
+# under the sha256 of their content (objects/), and each URL gets a small
+# json entry (urls/) pointing at its current body, so identical pages are
+# only stored once and a page's content hash is known without re-reading it
+def default_current_season():
+    # the season is still "live" through the bowl games in early January
+    today = datetime.date.today()
+    return today.year if today.month > 1 else today.year - 1
+
+
+settings = {
+    "dir": str(Path(__file__).parent.joinpath("../.cache/pages")),
+    "current_season": default_current_season(),
+    # pages for the current season (or later) go stale after this many hours
+    "current_ttl_hours": 12,
+    # pages without a season in the URL (player pages) refresh less often,
+    # unless they're fetched while crawling the current season
+    "undated_ttl_hours": 24 * 7,
+    # serve everything from disk and never touch the network
+    "offline": False,
+}
+
+YEAR_PATTERN = re.compile(r"(?<!\d)(?:19|20)\d{2}(?!\d)")
+
+
+class OfflineCacheMiss(requests.ConnectionError):
+    pass
+
+
+# the season the current thread is crawling, see crawling_season
+crawl_context = threading.local()
+
+
+@contextmanager
+def crawling_season(season):
+    # pages fetched inside this block are for the given season, which is how
+    # undated pages (player pages) get a ttl
+    previous = getattr(crawl_context, "season", None)
+    crawl_context.season = season
+    try:
+        yield
+    finally:
+        crawl_context.season = previous
+
+
+def full_url(url, params=None):
+    # the url the request actually goes to, query params included
+    if not params:
+        return url
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+def url_key(method, url):
+    return hashlib.sha256(f"{method.upper()} {url}".encode()).hexdigest()
+
+
+def entry_path(key):
+    return Path(settings["dir"]).joinpath("urls", key[:2], key + ".json")
+
+
+def object_path(content_hash):
+    return Path(settings["dir"]).joinpath(
+        "objects", content_hash[:2], content_hash + ".gz"
+    )
+
+
+def write_atomic(path, data):
+    # write to a temp file first so concurrent readers never see a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def ttl_seconds(url):
+    # past seasons never change, so their pages never expire
+    years = [int(y) for y in YEAR_PATTERN.findall(urlparse(url).path)]
+    if not years:
+        # a player page carries the current season's stats while it's being
+        # played, so when that's the season being crawled it goes stale as
+        # fast as the season's dated pages
+        season = getattr(crawl_context, "season", None)
+        if season is not None and season >= settings["current_season"]:
+            return settings["current_ttl_hours"] * 3600
+        return settings["undated_ttl_hours"] * 3600
+    if max(years) < settings["current_season"]:
+        return None
+    return settings["current_ttl_hours"] * 3600
+
+
+def read_entry(method, url):
+    path = entry_path(url_key(method, url))
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_fresh(entry, url):
+    if settings["offline"]:
+        return True
+    ttl = ttl_seconds(url)
+    return ttl is None or time.time() - entry["fetched_at"] < ttl
+
+
+def build_response(url, entry, body):
+    response = requests.models.Response()
+    response.url = url
+    response.status_code = entry["status"]
+    response.reason = entry["reason"]
+    response.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+    response.encoding = entry["encoding"]
+    response._content = body
+    return response
+
+
+def lookup(method, url, params=None):
+    url = full_url(url, params)
+    # HEAD requests (sportsipy's url_exists checks) can be answered by a GET
+    entry = read_entry("GET", url)
+    if entry is None and method.upper() == "HEAD":
+        entry = read_entry("HEAD", url)
+    if entry is None or not is_fresh(entry, url):
+        return None
+
+    body = b""
+    if method.upper() == "GET":
+        with gzip.open(object_path(entry["content_hash"])) as f:
+            body = f.read()
+    return build_response(url, entry, body)
+
+
+def store(method, url, response, params=None):
+    url = full_url(url, params)
+    # throttling and server errors are transient, never cache them
+    if response.status_code == 429 or response.status_code >= 500:
+        return
+
+    body = response.content if method.upper() == "GET" else b""
+    content_hash = hashlib.sha256(body).hexdigest()
+    path = object_path(content_hash)
+    if not path.exists():
+        write_atomic(path, gzip.compress(body))
+
+    entry = {
+        "url": url,
+        "status": response.status_code,
+        "reason": response.reason,
+        "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+        "encoding": response.encoding,
+        "content_hash": content_hash,
+        "fetched_at": time.time(),
+    }
+    write_atomic(entry_path(url_key(method, url)), json.dumps(entry).encode())
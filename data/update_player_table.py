@@ -1,12 +1,14 @@
-import sys
-import psycopg2
-from psycopg2.extras import execute_values
-from sportsipy.ncaaf.teams import Team
-from sportsipy.ncaaf.conferences import Conference
+import argparse
 import requests
 from bs4 import BeautifulSoup
 import yaml
 from pathlib import Path
+import build_db
+import db
+import fetch
+import bulk_load
+import crawl
+import metrics
 
 
 # from https://stackoverflow.com/a/63170705
@@ -17,281 +19,132 @@ def get_settings():
     return settings_data
 
 
-def get_heisman_votes_data(cursor, years=range(2000, 2022)):
-    for year in years:
-        page = requests.get(
-            f"https://www.sports-reference.com/cfb/awards/heisman-{year}.html"
-        )
-        soup = BeautifulSoup(page.content, "html.parser")
-        table = soup.find("table", id="heisman")
-        rows = table.tbody.findAll("tr")
-        for row in rows:
-            player_id = row.findAll("a")[0]["href"].split("/")[-1].split(".")[0]
-            votes = int(row.findAll("td")[-2].text)
+def parse_heisman_votes(year):
+    page = requests.get(
+        f"https://www.sports-reference.com/cfb/awards/heisman-{year}.html"
+    )
+    soup = BeautifulSoup(page.content, "html.parser")
+    table = soup.find("table", id="heisman")
+    rows = table.tbody.findAll("tr")
+    ballots = []
+    for row in rows:
+        player_id = row.findAll("a")[0]["href"].split("/")[-1].split(".")[0]
+        votes = int(row.findAll("td")[-2].text)
+        ballots.append((player_id, year, votes))
+
+    return ballots
+
+
+def load_votes(cursor, ballots):
+    # stage every ballot row with one COPY, then apply them all with a single
+    # update joined on the primary key
+    cursor.execute("DROP TABLE IF EXISTS staging_votes;")
+    cursor.execute(
+        """CREATE TEMP TABLE staging_votes(
+                player_id varchar(50) NOT NULL,
+                season integer NOT NULL,
+                votes integer NOT NULL
+            );"""
+    )
+    bulk_load.copy_rows(
+        cursor, "staging_votes", ["player_id", "season", "votes"], ballots
+    )
 
-            sql = f"""UPDATE player
-                    SET votes = {votes}
-                    WHERE player_id LIKE '{player_id}' AND season = '{year}';"""
-            cursor.execute(sql)
+    cursor.execute(
+        """UPDATE player AS p
+            SET votes = s.votes
+            FROM staging_votes s
+            WHERE p.player_id = s.player_id AND p.season = s.season;"""
+    )
+    metrics.count("votes_rows_written", cursor.rowcount)
+
+    # ballots that didn't match a scraped player mean the two sites disagree
+    # on a player_id (or the player's team isn't crawled), so surface them
+    cursor.execute(
+        """SELECT s.player_id, s.season
+            FROM staging_votes s
+            LEFT JOIN player p
+                ON p.player_id = s.player_id AND p.season = s.season
+            WHERE p.player_id IS NULL
+            ORDER BY s.season, s.player_id;"""
+    )
+    unmatched = cursor.fetchall()
+    cursor.execute("DROP TABLE staging_votes;")
 
+    return unmatched
 
-def get_sports_ref_data(cursor, years=range(2000, 2022)):
-    power_5 = ["big-12", "acc", "big-ten", "sec", "pac-12", "big-east", "independents"]
-    players = []
 
+def get_heisman_votes_data(cursor, years=range(2000, 2022)):
+    ballots = []
     for year in years:
-        # conferences in the power 5
-        for conf in power_5:
-            if conf == "pac-12" and year < 2011:
-                conf = "pac-10"
-            if conf == "big-east" and year > 2012:
-                continue
-
-            # some nonsense for independents schools
-            # BYU only relevant ind. team in 2020 (Notre Dame temporarily joined the ACC)
-            # Notre Dame & BYU independents from 2011 on (minus 2020)
-            # Only Notre Dame prior to 2011
-            if conf == "independents" and year == 2020:
-                conf_teams = ["Brigham-Young"]
-            elif conf == "independents" and year > 2010:
-                conf_teams = ["Notre-Dame", "Brigham-Young"]
-            elif conf == "independents":
-                conf_teams = ["Notre-Dame"]
-
-            else:
-                conference = Conference(conf, str(year))
-                conf_teams = conference.teams.keys()
-            # go through each team in the conference
-            for key in conf_teams:
-                team = Team(key.upper(), year=str(year))
-                roster = team.roster
-                # go through each player on the roster
-                for player in roster.players:
-                    # create dictionary of player stats and append it to the list
-                    try:
-                        if player(str(year)).season == "Career":
-                            continue
-                        # team name preprocessing
-                        team_abbrev = player(str(year)).team_abbreviation
-                        team_abbrev = team_abbrev.replace(" ", "-")
-                        team_abbrev = (
-                            team_abbrev.replace("(", "")
-                            .replace(")", "")
-                            .replace("&", "")
-                        )
-                        team_abbrev = team_abbrev.upper()
-                        d = {
-                            "player_id": player(str(year)).player_id,
-                            "season": player(str(year)).season,
-                            "team_abbreviation": team_abbrev,
-                            "position": player(str(year)).position,
-                            "year": player(str(year)).year,
-                            "games": player(str(year)).games,
-                            "completed_passes": player(str(year)).completed_passes,
-                            "pass_attempts": player(str(year)).pass_attempts,
-                            "passing_completion": player(str(year)).passing_completion,
-                            "passing_yards": player(str(year)).passing_yards,
-                            "passing_touchdowns": player(str(year)).passing_touchdowns,
-                            "interceptions_thrown": player(
-                                str(year)
-                            ).interceptions_thrown,
-                            "passing_yards_per_attempt": player(
-                                str(year)
-                            ).passing_yards_per_attempt,
-                            "adjusted_yards_per_attempt": player(
-                                str(year)
-                            ).adjusted_yards_per_attempt,
-                            "quarterback_rating": player(str(year)).quarterback_rating,
-                            "rush_attempts": player(str(year)).rush_attempts,
-                            "rush_yards": player(str(year)).rush_yards,
-                            "rush_yards_per_attempt": player(
-                                str(year)
-                            ).rush_yards_per_attempt,
-                            "rush_touchdowns": player(str(year)).rush_touchdowns,
-                            "receptions": player(str(year)).receptions,
-                            "receiving_yards": player(str(year)).receiving_yards,
-                            "receiving_yards_per_reception": player(
-                                str(year)
-                            ).receiving_yards_per_reception,
-                            "receiving_touchdowns": player(
-                                str(year)
-                            ).receiving_touchdowns,
-                            "plays_from_scrimmage": player(
-                                str(year)
-                            ).plays_from_scrimmage,
-                            "yards_from_scrimmage": player(
-                                str(year)
-                            ).yards_from_scrimmage,
-                            "yards_from_scrimmage_per_play": player(
-                                str(year)
-                            ).yards_from_scrimmage_per_play,
-                            "rushing_and_receiving_touchdowns": player(
-                                str(year)
-                            ).rushing_and_receiving_touchdowns,
-                            "solo_tackles": player(str(year)).solo_tackles,
-                            "assists_on_tackles": player(str(year)).assists_on_tackles,
-                            "total_tackles": player(str(year)).total_tackles,
-                            "tackles_for_loss": player(str(year)).tackles_for_loss,
-                            "sacks": player(str(year)).sacks,
-                            "interceptions": player(str(year)).interceptions,
-                            "yards_returned_from_interceptions": player(
-                                str(year)
-                            ).yards_returned_from_interceptions,
-                            "yards_returned_per_interception": player(
-                                str(year)
-                            ).yards_returned_per_interception,
-                            "interceptions_returned_for_touchdown": player(
-                                str(year)
-                            ).interceptions_returned_for_touchdown,
-                            "passes_defended": player(str(year)).passes_defended,
-                            "fumbles_recovered": player(str(year)).fumbles_recovered,
-                            "yards_recovered_from_fumble": player(
-                                str(year)
-                            ).yards_recovered_from_fumble,
-                            "fumbles_recovered_for_touchdown": player(
-                                str(year)
-                            ).fumbles_recovered_for_touchdown,
-                            "fumbles_forced": player(str(year)).fumbles_forced,
-                            "punt_return_touchdowns": player(
-                                str(year)
-                            ).punt_return_touchdowns,
-                            "kickoff_return_touchdowns": player(
-                                str(year)
-                            ).kickoff_return_touchdowns,
-                            "other_touchdowns": player(str(year)).other_touchdowns,
-                            "total_touchdowns": player(str(year)).total_touchdowns,
-                            "extra_points_made": player(str(year)).extra_points_made,
-                            "field_goals_made": player(str(year)).field_goals_made,
-                            "extra_points_attempted": player(
-                                str(year)
-                            ).extra_points_attempted,
-                            "extra_point_percentage": player(
-                                str(year)
-                            ).extra_point_percentage,
-                            "field_goals_attempted": player(
-                                str(year)
-                            ).field_goals_attempted,
-                            "field_goal_percentage": player(
-                                str(year)
-                            ).field_goal_percentage,
-                            "two_point_conversions": player(
-                                str(year)
-                            ).two_point_conversions,
-                            "safeties": player(str(year)).safeties,
-                            "points": player(str(year)).points,
-                        }
-                        # replace nulls with zeros
-                        no_null_d = {k: v or 0 for (k, v) in d.items()}
-                        players.append(no_null_d)
-                    except:
-                        pass
-
-                # remove duplicates
-                dedup_players = [dict(t) for t in {tuple(d.items()) for d in players}]
-                # write to db
-                columns = players[0].keys()
-                query = """INSERT INTO player ({}) VALUES %s 
-                            ON CONFLICT (player_id, season) DO UPDATE 
-                            SET 
-                                player_id = EXCLUDED.player_id,
-                                season = EXCLUDED.season,
-                                team_abbreviation = EXCLUDED.team_abbreviation,
-                                position = EXCLUDED.position,
-                                height = EXCLUDED.height,
-                                weight = EXCLUDED.weight,
-                                year = EXCLUDED.year,
-                                games = EXCLUDED.games,
-                                completed_passes = EXCLUDED.completed_passes,
-                                pass_attempts = EXCLUDED.pass_attempts,
-                                passing_completion = EXCLUDED.passing_completion,
-                                passing_yards = EXCLUDED.passing_yards,
-                                passing_touchdowns = EXCLUDED.passing_touchdowns,
-                                interceptions_thrown = EXCLUDED.interceptions_thrown,
-                                passing_yards_per_attempt = EXCLUDED.passing_yards_per_attempt,
-                                adjusted_yards_per_attempt = EXCLUDED.adjusted_yards_per_attempt,
-                                quarterback_rating = EXCLUDED.quarterback_rating,
-                                rush_attempts = EXCLUDED.rush_attempts,
-                                rush_yards = EXCLUDED.rush_yards,
-                                rush_yards_per_attempt = EXCLUDED.rush_yards_per_attempt,
-                                rush_touchdowns = EXCLUDED.rush_touchdowns,
-                                receptions = EXCLUDED.receptions,
-                                receiving_yards = EXCLUDED.receiving_yards,
-                                receiving_yards_per_reception = EXCLUDED.receiving_yards_per_reception,
-                                receiving_touchdowns = EXCLUDED.receiving_touchdowns,
-                                plays_from_scrimmage = EXCLUDED.plays_from_scrimmage,
-                                yards_from_scrimmage = EXCLUDED.yards_from_scrimmage,
-                                yards_from_scrimmage_per_play = EXCLUDED.yards_from_scrimmage_per_play,
-                                rushing_and_receiving_touchdowns = EXCLUDED.rushing_and_receiving_touchdowns,
-                                solo_tackles = EXCLUDED.solo_tackles,
-                                assists_on_tackles = EXCLUDED.assists_on_tackles,
-                                total_tackles = EXCLUDED.total_tackles,
-                                tackles_for_loss = EXCLUDED.tackles_for_loss,
-                                sacks = EXCLUDED.sacks,
-                                interceptions = EXCLUDED.interceptions,
-                                yards_returned_from_interceptions = EXCLUDED.yards_returned_from_interceptions,
-                                yards_returned_per_interception = EXCLUDED.yards_returned_per_interception,
-                                interceptions_returned_for_touchdown = EXCLUDED.interceptions_returned_for_touchdown,
-                                passes_defended = EXCLUDED.passes_defended,
-                                fumbles_recovered = EXCLUDED.fumbles_recovered,
-                                yards_recovered_from_fumble = EXCLUDED.yards_recovered_from_fumble,
-                                fumbles_recovered_for_touchdown = EXCLUDED.fumbles_recovered_for_touchdown,
-                                fumbles_forced = EXCLUDED.fumbles_forced,
-                                punt_return_touchdowns = EXCLUDED.punt_return_touchdowns,
-                                kickoff_return_touchdowns = EXCLUDED.kickoff_return_touchdowns,
-                                other_touchdowns = EXCLUDED.other_touchdowns,
-                                total_touchdowns = EXCLUDED.total_touchdowns,
-                                extra_points_made = EXCLUDED.extra_points_made,
-                                field_goals_made = EXCLUDED.field_goals_made,
-                                extra_points_attempted = EXCLUDED.extra_points_attempted,
-                                extra_point_percentage = EXCLUDED.extra_point_percentage,
-                                field_goals_attempted = EXCLUDED.field_goals_attempted,
-                                field_goal_percentage = EXCLUDED.field_goal_percentage,
-                                two_point_conversions = EXCLUDED.two_point_conversions,
-                                safeties = EXCLUDED.safeties,
-                                points = EXCLUDED.points;
-                        """.format(
-                    ",".join(columns)
-                )
-                values = [
-                    [value for value in player.values()] for player in dedup_players
-                ]
-                execute_values(cursor, query, values)
-                conn.commit()
-
-                players = []
-
-
-def main(cursor, years=None):
-    if len(years) == 1:
-        get_sports_ref_data(cursor, years)
+        with metrics.timer("votes_parse"):
+            ballots.extend(parse_heisman_votes(year))
+
+    with metrics.timer("votes_write"):
+        unmatched = load_votes(cursor, ballots)
+    metrics.count("ballots_parsed", len(ballots))
+    metrics.count("ballots_unmatched", len(unmatched))
+    for player_id, season in unmatched:
+        print(f"No player {player_id} in season {season} for Heisman ballot")
+    print(f"Loaded {len(ballots)} Heisman ballot rows, {len(unmatched)} unmatched")
+
+
+def main(cursor, years=None, workers=1, resume=True):
+    # the crawl writes each roster's team row too, so fk_team always resolves
+    if years and len(years) == 1:
+        crawl.run(cursor, years, workers, resume)
     elif years:
-        get_sports_ref_data(cursor, years)
+        crawl.run(cursor, years, workers, resume)
         get_heisman_votes_data(cursor, years)
     else:
-        get_sports_ref_data(cursor)
+        crawl.run(cursor, workers=workers, resume=resume)
         get_heisman_votes_data(cursor)
 
+    # only the seasons this run wrote need re-joining
+    with metrics.timer("feature_refresh"):
+        rows = build_db.refresh_player_features(cursor, years or range(2000, 2022))
+    print(f"Refreshed {rows} player feature rows")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("start", type=int, nargs="?", help="first season to pull")
+    parser.add_argument("end", type=int, nargs="?", help="last season (inclusive)")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="number of concurrent page fetchers"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only read pages from the local cache"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="re-scrape teams even if they're unchanged"
+    )
+    parser.add_argument(
+        "--report",
+        default="ingest_report.json",
+        help="where to write the run's metrics (.json or .csv)",
+    )
+    return parser.parse_args()
 
-if __name__ == "__main__":
 
+if __name__ == "__main__":
+    args = parse_args()
     config = get_settings()
+    fetch.install(config, args.offline)
 
     # connect to db
-    conn = psycopg2.connect(
-        database=config["db"]["database"],
-        user=config["db"]["user"],
-        password=config["db"]["password"],
-        host=config["db"]["host"],
-    )
-    conn.autocommit = True
+    conn = db.connect(config)
     cursor = conn.cursor()
 
-    if len(sys.argv) > 1:
-        years = [int(sys.argv[1])]
-        main(cursor, years)
+    if args.start:
+        years = range(args.start, (args.end or args.start) + 1)
+        main(cursor, years, args.workers, not args.full)
     else:
-        main(cursor)
+        main(cursor, workers=args.workers, resume=not args.full)
 
     # close db
     conn.commit()
     conn.close()
+
+    metrics.write_report(args.report)
+    print(f"Wrote ingest metrics to {args.report}")
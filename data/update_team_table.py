@@ -1,10 +1,11 @@
-import sys
-import psycopg2
-from psycopg2.extras import execute_values
-from sportsipy.ncaaf.teams import Team
-from sportsipy.ncaaf.conferences import Conference
+import argparse
 import yaml
 from pathlib import Path
+import build_db
+import db
+import fetch
+import crawl
+import metrics
 
 
 # from https://stackoverflow.com/a/63170705
@@ -15,117 +16,55 @@ def get_settings():
     return settings_data
 
 
-def get_sports_ref_data(cursor, years=range(2000, 2022)):
-    power_5 = ["big-12", "acc", "big-ten", "sec", "pac-12", "big-east", "independents"]
-    teams = []
-
-    for year in years:
-        # conferences in the power 5
-        for conf in power_5:
-            if conf == "pac-12" and year < 2011:
-                conf = "pac-10"
-            if conf == "big-east" and year > 2012:
-                continue
-
-            # some nonsense for independents schools
-            # BYU only relevant ind. team in 2020 (Notre Dame temporarily joined the ACC)
-            # Notre Dame & BYU independents from 2011 on (minus 2020)
-            # Only Notre Dame prior to 2011
-            if conf == "independents" and year == 2020:
-                conf_teams = ["brigham-young"]
-            elif conf == "independents" and year > 2010:
-                conf_teams = ["notre-dame", "brigham-young"]
-            elif conf == "independents":
-                conf_teams = ["notre-dame"]
-
-            # not independent
-            else:
-                conference = Conference(conf, str(year))
-                conf_teams = conference.teams.keys()
-            # go through each team in the conference
-            for t in conf_teams:
-                team = Team(t.upper(), year=str(year))
-                # team name preprocessing
-                team_abbrev = team.abbreviation
-                if team_abbrev == "LOUISIANA-STATE":
-                    team_abbrev = "LSU"
-                elif team_abbrev == "MISSISSIPPI":
-                    team_abbrev = "OLE-MISS"
-                elif team_abbrev == "SOUTHERN-CALIFORNIA":
-                    team_abbrev = "USC"
-                elif team_abbrev == "PITTSBURGH":
-                    team_abbrev = "PITT"
-                elif team_abbrev == "TEXAS-CHRISTIAN":
-                    team_abbrev = "TCU"
-
-                try:
-                    d = {
-                        "team_id": team_abbrev,
-                        "season": str(year),
-                        "conference": team.conference,
-                        "win_percentage": team.win_percentage,
-                        "points_per_game": team.points_per_game,
-                        "points_against_per_game": team.points_against_per_game,
-                        "strength_of_schedule": team.strength_of_schedule,
-                        "simple_rating_system": team.simple_rating_system,
-                    }
-                    # replace nulls with zeros
-                    no_null_d = {k: v or 0 for (k, v) in d.items()}
-                    teams.append(no_null_d)
-                except:
-                    pass
-
-            # write to db
-            columns = teams[0].keys()
-            query = """INSERT INTO team ({}) VALUES %s
-                        ON CONFLICT (team_id, season) DO UPDATE
-                        SET
-                            team_id = EXCLUDED.team_id,
-                            season = EXCLUDED.season,
-                            conference = EXCLUDED.conference,
-                            win_percentage = EXCLUDED.win_percentage,
-                            points_per_game = EXCLUDED.points_per_game,
-                            points_against_per_game = EXCLUDED.points_against_per_game,
-                            strength_of_schedule = EXCLUDED.strength_of_schedule,
-                            simple_rating_system = EXCLUDED.simple_rating_system;
-                        """.format(
-                ",".join(columns)
-            )
-            values = [[value for value in team.values()] for team in teams]
-            execute_values(cursor, query, values)
-            conn.commit()
-
-            print(f"Wrote to db conference {conf} in year {year}")
+def main(cursor, years=None, workers=1):
+    # same crawl as update_player_table, minus the rosters
+    if years:
+        crawl.run(cursor, years, workers, with_players=False)
+    else:
+        crawl.run(cursor, workers=workers, with_players=False)
 
-            teams = []
+    # team stats are part of every player's features
+    with metrics.timer("feature_refresh"):
+        rows = build_db.refresh_player_features(cursor, years or range(2000, 2022))
+    print(f"Refreshed {rows} player feature rows")
 
 
-def main(cursor, years=None):
-    if years:
-        get_sports_ref_data(cursor, years)
-    else:
-        get_sports_ref_data(cursor)
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("start", type=int, nargs="?", help="first season to pull")
+    parser.add_argument("end", type=int, nargs="?", help="last season (inclusive)")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="number of concurrent page fetchers"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only read pages from the local cache"
+    )
+    parser.add_argument(
+        "--report",
+        default="ingest_report.json",
+        help="where to write the run's metrics (.json or .csv)",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     config = get_settings()
+    fetch.install(config, args.offline)
 
     # connection establishment
-    conn = psycopg2.connect(
-        database=config["db"]["database"],
-        user=config["db"]["user"],
-        password=config["db"]["password"],
-        host=config["db"]["host"],
-    )
-    conn.autocommit = True
+    conn = db.connect(config)
     cursor = conn.cursor()
 
-    if len(sys.argv) > 1:
-        years = [int(sys.argv[1])]
-        main(cursor, years)
+    if args.start:
+        years = range(args.start, (args.end or args.start) + 1)
+        main(cursor, years, args.workers)
     else:
-        main(cursor)
+        main(cursor, workers=args.workers)
 
     # close db
     conn.commit()
     conn.close()
+
+    metrics.write_report(args.report)
+    print(f"Wrote ingest metrics to {args.report}")
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import Lasso
+from sklearn.linear_model import PoissonRegressor
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+
+# the raw player_feature columns that are one-hot encoded. team and conference
+# are encoded from their names so the columns mean the same in every database
+CATEGORICAL = ["year", "position", "team_abbreviation", "conference"]
+
+# columns of a raw player_feature row that aren't features: ids, the season
+# and the target
+NON_FEATURES = [
+    "player_id",
+    "season",
+    "votes",
+    "player_key",
+    "team_key",
+    "conference_key",
+]
+
+# estimators that take the categoricals as integer codes rather than one-hot
+# columns. they bin each category on its own, so a categorical can only be
+# coded when it has no more categories than the estimator's max_bins (255 by
+# default, and at most)
+MAX_BINS = 255
+CODED_ESTIMATORS = (HistGradientBoostingClassifier, HistGradientBoostingRegressor)
+
+# estimators that fit the one-hot layout as a sparse matrix directly, and
+# faster than a dense one since the one-hot columns leave it mostly zeros.
+# the rest get it dense: the trees, LinearRegression, whose sparse solver
+# doesn't settle on the same answer for the collinear one-hot columns, and
+# Ridge, whose default solver turns from an exact cholesky solve into an
+# iterative sparse_cg on csr and moves its predictions. it only fits on the
+# few vote getters, so dense costs it little
+SPARSE_ESTIMATORS = (LogisticRegression, Lasso, PoissonRegressor)
+
+
+class FeatureEncoder:
+    # maps raw player_feature rows to the models' column layout. fitting it on
+    # the training rows records the numeric columns and every category seen,
+    # transform_sparse then encodes any rows into exactly those columns,
+    # leaving categories it wasn't fit on all zero. it's pickled with the
+    # models, so prediction encodes rows the same way training did
+    def fit(self, df):
+        self.numeric = [
+            column
+            for column in df.columns
+            if column not in CATEGORICAL and column not in NON_FEATURES
+        ]
+        self.categories = {
+            column: sorted(df[column].dropna().unique()) for column in CATEGORICAL
+        }
+
+        # named like get_dummies would name them
+        self.columns = self.numeric + [
+            f"{column}_{value}"
+            for column in CATEGORICAL
+            for value in self.categories[column]
+        ]
+        return self
+
+    def get_coded(self, max_bins=MAX_BINS):
+        # the categoricals an estimator with this max_bins can take as codes,
+        # the rest stay one-hot in the coded layout too
+        return [
+            column for column in CATEGORICAL if len(self.categories[column]) <= max_bins
+        ]
+
+    def get_coded_columns(self, max_bins=MAX_BINS):
+        # the layout transform_codes produces: the numeric columns, the
+        # one-hot columns of the categoricals too wide to code, then one
+        # column of codes per coded categorical
+        coded = self.get_coded(max_bins)
+        return (
+            self.numeric
+            + [
+                f"{column}_{value}"
+                for column in CATEGORICAL
+                if column not in coded
+                for value in self.categories[column]
+            ]
+            + coded
+        )
+
+    def get_categorical_mask(self, max_bins=MAX_BINS):
+        # which columns of the coded layout are categorical, for the
+        # estimator's categorical_features
+        coded = self.get_coded(max_bins)
+        return np.array(
+            [column in coded for column in self.get_coded_columns(max_bins)]
+        )
+
+    def transform_sparse(self, df):
+        # the one-hot layout as csr: the numeric block next to a one-hot
+        # block built straight from the category codes, so the wide matrix
+        # is never dense
+        numeric = sparse.csr_matrix(
+            df[self.numeric].to_numpy(dtype=np.float32, na_value=np.nan)
+        )
+
+        rows, columns = [], []
+        offset = 0
+        for column in CATEGORICAL:
+            codes = pd.Categorical(df[column], categories=self.categories[column]).codes
+            seen = np.flatnonzero(codes >= 0)
+            rows.append(seen)
+            columns.append(offset + codes[seen])
+            offset += len(self.categories[column])
+        rows = np.concatenate(rows)
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, np.concatenate(columns))),
+            shape=(len(df), offset),
+        )
+
+        return sparse.hstack([numeric, one_hot], format="csr")
+
+    def transform(self, df):
+        # the one-hot layout dense, for the estimators that can't take csr
+        return self.transform_sparse(df).toarray()
+
+    def transform_codes(self, df, max_bins=MAX_BINS):
+        # the coded layout (see get_coded_columns) for the CODED_ESTIMATORS.
+        # categories it wasn't fit on are missing
+        coded = self.get_coded(max_bins)
+        X = np.zeros((len(df), len(self.get_coded_columns(max_bins))), dtype=np.float32)
+        X[:, : len(self.numeric)] = df[self.numeric].to_numpy(
+            dtype=np.float32, na_value=np.nan
+        )
+
+        offset = len(self.numeric)
+        for column in CATEGORICAL:
+            if column in coded:
+                continue
+            codes = pd.Categorical(df[column], categories=self.categories[column]).codes
+            rows = np.flatnonzero(codes >= 0)
+            X[rows, offset + codes[rows]] = 1
+            offset += len(self.categories[column])
+
+        for i, column in enumerate(coded, offset):
+            codes = pd.Categorical(df[column], categories=self.categories[column]).codes
+            X[:, i] = np.where(codes >= 0, codes, np.nan)
+
+        return X
+
+    def transform_for(self, model, df):
+        # the rows in the layout model was trained on
+        if isinstance(model, CODED_ESTIMATORS):
+            return self.transform_codes(df, model.get_params()["max_bins"])
+        if isinstance(model, SPARSE_ESTIMATORS):
+            return self.transform_sparse(df)
+        return self.transform(df)
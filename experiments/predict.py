@@ -5,6 +5,12 @@ import sqlalchemy
 from pathlib import Path
 import numpy as np
 import pandas as pd
+import sys
+import snapshot
+
+sys.path.insert(0, str(Path(__file__).parent.joinpath("../data").resolve()))
+
+import db
 
 
 def connect_to_db():
@@ -13,31 +19,23 @@ def connect_to_db():
     with open(full_file_path) as settings:
         secrets = yaml.load(settings, Loader=yaml.Loader)
 
-    database = secrets["db"]["database"]
-    user = secrets["db"]["user"]
-    password = secrets["db"]["password"]
-    host = secrets["db"]["host"]
-
-    url = f"postgresql+psycopg2://{user}:{password}@{host}/{database}"
-    engine = sqlalchemy.create_engine(url)
-
-    return engine
+    # postgres or the embedded sqlite file, whichever config.yml picks
+    return sqlalchemy.create_engine(db.get_url(secrets))
 
 
 def get_player_data(engine):
-    # read recent data
+    # read recent data, already joined with the team's stats. served from a
+    # snapshot until player_feature is next refreshed
     sql = """select *
-            from player p 
-            inner join team t
-                on p.team_abbreviation = t.team_id 
-                and p.season = t.season
-            where p.season = 2022;
+            from player_feature
+            where season = 2022;
             """
-    with engine.connect().execution_options(autocommit=True) as conn:
-        query = conn.execute(sql)
 
-    df = pd.DataFrame(query.fetchall())
-    return df
+    def read():
+        with engine.connect() as conn:
+            return pd.read_sql(sql, conn)
+
+    return snapshot.cached(engine, sql, read)
 
 
 def get_model_data(engine):
@@ -63,43 +61,32 @@ def get_model_data(engine):
     full_file_path = Path(__file__).parent.joinpath("reg_model.pkl")
     with open(full_file_path, "rb") as f:
         reg_model = pickle.load(f)
+    # the feature encoder the models were trained with (model.encoder_object)
+    full_file_path = Path(__file__).parent.joinpath("encoder.pkl")
+    with open(full_file_path, "rb") as f:
+        encoder = pickle.load(f)
 
-    return clf_model, reg_model
-
-
-def predict(player_data, clf, reg):
-    # preprocessing
-    df = player_data.convert_dtypes()
-    df = pd.get_dummies(
-        df, columns=["year", "position", "team_abbreviation", "conference"]
-    )
-    df = df.drop(["player_id", "season", "votes", "team_id"], axis=1)
+    return clf_model, reg_model, encoder
 
-    # add in missing columns
-    for col in clf.feature_names_in_:
-        if col not in df.columns:
-            df[col] = 0
 
-    # reorder columns
-    df = df[clf.feature_names_in_.tolist()]
+def predict(player_data, clf, reg, encoder):
+    # preprocessing, into the columns each model was trained on
+    X = encoder.transform_for(clf, player_data)
 
     # make predictions
-    clf_pred = clf.predict_proba(df)
+    clf_pred = clf.predict_proba(X)
 
     # grab the 10 players with the highest predicted "probability"
     idxs = np.argpartition(clf_pred[:, 1], -10)[-10:]
-    got_votes_pred = np.zeros(len(clf_pred))
-    got_votes_pred[idxs] = 1
-
-    df = df[np.where(got_votes_pred == 1, True, False)]
-
-    # make predictions
-    votes_pred = reg.predict(df)
 
+    # make predictions for just those players, in the same order as idxs
     return_df = player_data.iloc[idxs]
+    X = encoder.transform_for(reg, return_df)
+    votes_pred = reg.predict(X.astype(np.float64))
+
     return_df["projected_votes"] = votes_pred
+    return_df = return_df.rename(columns={"team_abbreviation": "team_id"})
     return_df = return_df[["player_id", "team_id", "season", "projected_votes"]]
-    return_df = return_df.T.drop_duplicates().T
 
     return return_df
 
@@ -112,6 +99,6 @@ def write_predictions(engine, predictions):
 if __name__ == "__main__":
     engine = connect_to_db()
     player_data = get_player_data(engine)
-    clf_model, reg_model = get_model_data(engine)
-    predictions = predict(player_data, clf_model, reg_model)
+    clf_model, reg_model, encoder = get_model_data(engine)
+    predictions = predict(player_data, clf_model, reg_model, encoder)
     write_predictions(engine, predictions)
@@ -1,26 +1,44 @@
-import psycopg2
 import pandas as pd
 import sqlalchemy
 from sqlalchemy import text
 import yaml
 import numpy as np
+from scipy import sparse
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.linear_model import LinearRegression
 from sklearn.linear_model import Ridge
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.ensemble import HistGradientBoostingRegressor
 from sklearn.linear_model import Lasso
 from sklearn.linear_model import PoissonRegressor
 from sklearn.metrics import precision_recall_fscore_support
 from sklearn.metrics import mean_squared_error
 import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import threadpoolctl
+from joblib import Parallel, delayed
+from sklearn.base import clone
 import warnings
 import itertools
 import logging
 import pickle
 import os
+import shutil
+import tempfile
 import uuid
+import sys
+from pathlib import Path
+import features
+import snapshot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data"))
+
+import build_db
+import db
 
 
 def get_yaml(path):
@@ -32,351 +50,773 @@ def get_yaml(path):
 
 
 def connect_to_db(secrets):
+    # postgres or the embedded sqlite file, whichever config.yml picks
+    return sqlalchemy.create_engine(db.get_url(secrets))
+
+
+def get_feature_dtypes():
+    # the numpy dtype of every player_feature column, from its declaration in
+    # build_db: counts fit in int16 and rates in float32. the surrogate keys
+    # aren't features (team and conference are one-hot encoded from their
+    # names so the columns mean the same in every database) so aren't read
+    sql_dtypes = {"integer": np.int16, "real": np.float32}
+    return {
+        name: sql_dtypes.get(definition.split()[0], object)
+        for name, definition in build_db.FEATURE_COLUMNS
+    }
+
+
+FEATURE_DTYPES = get_feature_dtypes()
+
+# player_feature is already joined, deduplicated and typed by the ingest
+# scripts (see build_db.refresh_player_features)
+FEATURE_SQL = f"select {', '.join(FEATURE_DTYPES)} from player_feature;"
+
+
+def retrieve_data(engine, chunksize=10000):
+    # rows are streamed in chunks (through a server side cursor on postgres)
+    # into one preallocated array per dtype, laid out like a pandas block, so
+    # the frame wraps them without a copy and peak memory stays close to the
+    # size of the finished frame
+    groups = {}
+    for name, dtype in FEATURE_DTYPES.items():
+        groups.setdefault(np.dtype(dtype), []).append(name)
+    positions = {name: i for i, name in enumerate(FEATURE_DTYPES)}
+
+    with engine.connect() as conn:
+        n = conn.execute(text("select count(*) from player_feature;")).scalar()
+        blocks = {
+            dtype: np.empty((len(names), n), dtype) for dtype, names in groups.items()
+        }
+        result = conn.execution_options(stream_results=True).execute(text(FEATURE_SQL))
+
+        filled = 0
+        for rows in result.partitions(chunksize):
+            end = filled + len(rows)
+            if end > n:
+                # rows were added between the count and the select
+                n = max(end, 2 * n)
+                for dtype, block in blocks.items():
+                    extra = np.empty((block.shape[0], n - block.shape[1]), dtype)
+                    blocks[dtype] = np.concatenate([block, extra], axis=1)
+
+            values = list(zip(*rows))
+            for dtype, names in groups.items():
+                for i, name in enumerate(names):
+                    column = np.asarray(values[positions[name]])
+                    if dtype.kind == "i" and (
+                        column.min() < np.iinfo(dtype).min
+                        or column.max() > np.iinfo(dtype).max
+                    ):
+                        raise ValueError(f"{name} doesn't fit in {dtype}")
+                    blocks[dtype][i, filled:end] = column
+            filled = end
+
+    frames = [
+        pd.DataFrame(blocks[dtype][:, :filled].T, columns=names, copy=False)
+        for dtype, names in groups.items()
+    ]
+    return pd.concat(frames, axis=1, copy=False)
+
+
+def plan_folds(df):
+    # everything the walk-forward folds need, converted once per process
+    # instead of once per fold and combo. rows are sorted by season so each
+    # fold's training set is a prefix of the matrices and its test set a
+    # slice, so the folds index views rather than copying. the encoder is fit
+    # on every season, like the dummies it replaced were, and is saved with
+    # the models so predict.py encodes the same way
+    df = df.sort_values("season", kind="stable")
+    seasons = df["season"].to_numpy()
+    encoder = features.FeatureEncoder().fit(df)
+    votes = df["votes"].to_numpy(dtype=np.float64, na_value=0)
+    got_votes = (votes > 0).astype(np.int64)
+
+    # the regression stage only trains on players who got votes. that's few
+    # enough rows to keep in float64, which unregularised least squares on
+    # the collinear one-hot columns needs
+    voted = votes > 0
+    voted_seasons = seasons[voted]
+
+    folds = []
+    for test_year in range(2006, 2022):
+        start, end = np.searchsorted(seasons, [test_year, test_year + 1])
+        folds.append(
+            {
+                "test_year": test_year,
+                "train": slice(0, start),
+                "test": slice(start, end),
+                "voted_train": slice(0, np.searchsorted(voted_seasons, test_year)),
+            }
+        )
 
-    database = secrets["db"]["database"]
-    user = secrets["db"]["user"]
-    password = secrets["db"]["password"]
-    host = secrets["db"]["host"]
-
-    url = f"postgresql+psycopg2://{user}:{password}@{host}/{database}"
-    engine = sqlalchemy.create_engine(url)
-
-    return engine
-
+    return {
+        "encoder": encoder,
+        "df": df,
+        "voted": voted,
+        "got_votes": got_votes,
+        "votes": votes,
+        "votes_voted": votes[voted],
+        "folds": folds,
+    }
+
+
+def get_matrices(plan, estimator):
+    # (X, X_voted) in the layout the estimator takes. each layout is only
+    # built the first time an estimator asks for it and kept on the plan for
+    # every fold and config after it: the coded one once per max_bins, the
+    # one-hot csr once for the estimators that aren't coded, and its dense
+    # copies once for the ones that can't take csr
+    if isinstance(estimator, features.CODED_ESTIMATORS):
+        max_bins = estimator.get_params()["max_bins"]
+        key = f"X_codes_{max_bins}"
+        if key not in plan:
+            plan[key] = plan["encoder"].transform_codes(plan["df"], max_bins)
+            plan[f"X_voted_codes_{max_bins}"] = plan[key][plan["voted"]]
+        return plan[key], plan[f"X_voted_codes_{max_bins}"]
+
+    if "X_sparse" not in plan:
+        plan["X_sparse"] = plan["encoder"].transform_sparse(plan["df"])
+        plan["X_voted_sparse"] = plan["X_sparse"][plan["voted"]].astype(np.float64)
+    if isinstance(estimator, features.SPARSE_ESTIMATORS):
+        return plan["X_sparse"], plan["X_voted_sparse"]
+
+    if "X" not in plan:
+        plan["X"] = plan["X_sparse"].toarray()
+        plan["X_voted"] = plan["X_voted_sparse"].toarray()
+    return plan["X"], plan["X_voted"]
+
+
+def run_clf_fold(plan, fold, clf_model, X):
+    train, test = fold["train"], fold["test"]
+
+    # train on every season before the test season
+    # target variable is whether or not the player got in the top 10 votes
+    y_test = plan["got_votes"][test]
+    clf = clf_model.fit(X[train], plan["got_votes"][train])
+
+    # grab the 10 players with the highest predicted "probability"
+    idxs = np.argpartition(clf.predict_proba(X[test])[:, 1], -10)[-10:]
+    y_pred = np.zeros(len(y_test))
+    y_pred[idxs] = 1
+
+    prec, recall, fscore, _ = precision_recall_fscore_support(
+        y_test, y_pred, average="macro"
+    )
 
-def retrieve_data(engine):
-    sql = """
-    select *
-    from player p 
-    inner join team t
-        on p.team_abbreviation = t.team_id 
-        and p.season = t.season;
-    """
-    with engine.connect().execution_options(autocommit=True) as conn:
-        query = conn.execute(text(sql))
+    return (
+        clf,
+        y_pred == 1,
+        {"precision": prec, "recall": recall, "fscore": fscore},
+    )
 
-    df = pd.DataFrame(query.fetchall())
 
-    df = df.T.drop_duplicates().T
-    df = df.convert_dtypes()
+def run_reg_fold(plan, fold, reg_model, X, X_voted):
+    # here the target variable is the number of votes received, trained on
+    # the earlier seasons' vote getters. which of the test season's players
+    # it's scored on depends on the classifier, so predict all of them
+    voted_train = fold["voted_train"]
+    reg = reg_model.fit(X_voted[voted_train], plan["votes_voted"][voted_train])
+    y_pred = reg.predict(X[fold["test"]].astype(np.float64))
+
+    return reg, y_pred
+
+
+# the walk-forward folds are independent, so with fold_jobs > 1 they're fit
+# concurrently, each on its own clone of the estimator. threads rather than
+# processes: the fits release the gil, the folds share the plan without
+# copying it, and they nest safely inside the grid's workers. warning filters
+# are process wide and catch_warnings isn't thread safe, so the folds' warnings
+# are silenced once here, around all of them, rather than in each fold
+def run_clf(plan, clf_model, fold_jobs=1, fold_ids=None):
+    # fits the folds at the given positions in plan["folds"] (all of them by
+    # default). results are keyed by position so runs over different folds of
+    # the same config can be merged (see merge_runs)
+    if fold_ids is None:
+        fold_ids = range(len(plan["folds"]))
+    X, _ = get_matrices(plan, clf_model)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        folds = Parallel(n_jobs=fold_jobs, prefer="threads")(
+            delayed(run_clf_fold)(plan, plan["folds"][i], clone(clf_model), X)
+            for i in fold_ids
+        )
 
-    return df
+    # only the model from the last fold is kept, fit on every season before
+    # 2021
+    results = dict(zip(fold_ids, folds))
+    last = results.get(len(plan["folds"]) - 1)
+    return {
+        "model": last[0] if last else None,
+        "picked": {i: picked for i, (_, picked, _) in results.items()},
+        "metrics": {i: fold_metrics for i, (_, _, fold_metrics) in results.items()},
+    }
+
+
+def run_reg(plan, reg_model, fold_jobs=1, fold_ids=None):
+    if fold_ids is None:
+        fold_ids = range(len(plan["folds"]))
+    X, X_voted = get_matrices(plan, reg_model)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        folds = Parallel(n_jobs=fold_jobs, prefer="threads")(
+            delayed(run_reg_fold)(plan, plan["folds"][i], clone(reg_model), X, X_voted)
+            for i in fold_ids
+        )
 
+    results = dict(zip(fold_ids, folds))
+    last = results.get(len(plan["folds"]) - 1)
+    return {
+        "model": last[0] if last else None,
+        "predictions": {i: y_pred for i, (_, y_pred) in results.items()},
+    }
 
-def data_prep(df):
-    df = pd.get_dummies(
-        df, columns=["year", "position", "team_abbreviation", "conference"]
-    )
-    df["votes"] = df["votes"].fillna(0)
-    df["got_votes"] = np.where(df["votes"] > 0, 1, 0)
 
-    return df
+def merge_runs(run, more):
+    # a run of a config over some folds plus a run of it over others
+    merged = {"model": more["model"] if more["model"] is not None else run["model"]}
+    for key in run.keys() - {"model"}:
+        merged[key] = {**run[key], **more[key]}
+    return merged
 
 
-def run_model(df, clf_model, reg_model):
+def score_model(plan, clf_run, reg_run):
     precs = []
     recalls = []
     fscores = []
     rmses = []
     metrics_d = {}
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
+    for i, fold in enumerate(plan["folds"]):
+        picked = clf_run["picked"][i]
+        fold_metrics = clf_run["metrics"][i]
+        y_pred = reg_run["predictions"][i]
+        test_year = fold["test_year"]
+        prec = fold_metrics["precision"]
+        recall = fold_metrics["recall"]
+        fscore = fold_metrics["fscore"]
+
+        # the regressor is scored on the 10 players the classifier picked
+        y_test = plan["votes"][fold["test"]]
+        rmse = math.sqrt(mean_squared_error(y_test[picked], y_pred[picked]))
+
+        # print out classification log
+        precs.append(prec)
+        recalls.append(recall)
+        fscores.append(fscore)
+        logging.info(
+            f"Year: {test_year}, Precision: {prec}, Recall: {recall}, F-score: {fscore}"
+        )
 
-        for test_year in range(2006, 2022):
-            # separate out training/test for time series data
-            train = df[df["season"] < test_year]
-            test = df[df["season"] == test_year]
-
-            # X/y split
-            # X is all features except the target and player_id, season
-            # target variable is whether or not the player got in the top 10 votes
-            X_train = train.drop(["player_id", "season", "got_votes", "votes"], axis=1)
-            y_train = train[["got_votes"]]
-            X_test = test.drop(["player_id", "season", "got_votes", "votes"], axis=1)
-            y_test = test[["got_votes"]]
-
-            # train the classification model
-            clf = clf_model.fit(X_train, y_train.values.ravel())
-
-            # grab the 10 players with the highest predicted "probability"
-            idxs = np.argpartition(clf.predict_proba(X_test)[:, 1], -10)[-10:]
-            y_pred = np.zeros(len(y_test))
-            y_pred[idxs] = 1
-
-            # print out classification log
-            prec, recall, fscore, _ = precision_recall_fscore_support(
-                y_test, y_pred, average="macro"
-            )
-            precs.append(prec)
-            recalls.append(recall)
-            fscores.append(fscore)
-            logging.info(
-                f"Year: {test_year}, Precision: {prec}, Recall: {recall}, F-score: {fscore}"
-            )
+        # print out regression log
+        rmses.append(rmse)
+        logging.info(f"Year: {test_year}, RMSE: {rmse}")
 
-            # put in dict for logging to db
-            metrics_d["precision_" + str(test_year)] = prec
-            metrics_d["recall_" + str(test_year)] = recall
-            metrics_d["fscore_" + str(test_year)] = fscore
+        # put in dict for logging to db
+        metrics_d["precision_" + str(test_year)] = prec
+        metrics_d["recall_" + str(test_year)] = recall
+        metrics_d["fscore_" + str(test_year)] = fscore
+        metrics_d["rmse_" + str(test_year)] = rmse
 
-            # X/y split for regression
-            # here the target variable is the number of votes received
-            test = test[np.where(y_pred == 1, True, False)]
-            X_train = train[train["votes"] > 0].drop(
-                ["player_id", "season", "got_votes", "votes"], axis=1
-            )
-            y_train = train[train["votes"] > 0][["votes"]]
-            X_test = test.drop(["player_id", "season", "got_votes", "votes"], axis=1)
-            y_test = test[["votes"]]
+    precision_avg = sum(precs) / len(precs)
+    recall_avg = sum(recalls) / len(recalls)
+    fscore_avg = sum(fscores) / len(fscores)
+    rmse_avg = sum(rmses) / len(rmses)
 
-            # train the regression model
-            reg = reg_model.fit(X_train, y_train.values.ravel())
+    logging.info(
+        f"""Avg Precision: {precision_avg}, Avg Recall: {recall_avg}, Avg F-score: {fscore_avg}, Avg RMSE: {rmse_avg}"""
+    )
 
-            # print out regression log
-            y_pred = reg.predict(X_test)
-            rmse = math.sqrt(mean_squared_error(y_test, y_pred))
-            rmses.append(rmse)
-            logging.info(f"Year: {test_year}, RMSE: {rmse}")
+    metrics_d["precision_avg"] = precision_avg
+    metrics_d["recall_avg"] = recall_avg
+    metrics_d["fscore_avg"] = fscore_avg
+    metrics_d["rmse_avg"] = rmse_avg
+
+    return metrics_d
+
+
+def write_model_run(
+    engine,
+    clf_name,
+    reg_name,
+    clf_params,
+    reg_params,
+    clf_fit,
+    reg_fit,
+    metrics_d,
+    encoder,
+):
+    model_id = str(uuid.uuid4())
+
+    # split metrics_d into the averages and one long row per metric and season
+    averages = {}
+    season_metrics = []
+    for key, value in metrics_d.items():
+        metric, season = key.rsplit("_", 1)
+        if season == "avg":
+            averages[key] = value
+        else:
+            season_metrics.append(
+                {
+                    "model_id": model_id,
+                    "season": int(season),
+                    "metric": metric,
+                    "value": value,
+                }
+            )
 
-            # put in dict for logging to db
-            metrics_d["rmse_" + str(test_year)] = rmse
+    # save model artifact as pickle
+    clf_bin_str = pickle.dumps(clf_fit)
+    reg_bin_str = pickle.dumps(reg_fit)
+    encoder_bin_str = pickle.dumps(encoder)
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                insert into model (
+                    model_id, clf_model_object, reg_model_object, encoder_object
+                )
+                values (
+                    :model_id, :clf_model_object, :reg_model_object, :encoder_object
+                )
+                """
+            ),
+            {
+                "model_id": model_id,
+                "clf_model_object": clf_bin_str,
+                "reg_model_object": reg_bin_str,
+                "encoder_object": encoder_bin_str,
+            },
+        )
+        conn.execute(
+            text(
+                """
+                insert into model_summary (
+                    model_id,
+                    clf,
+                    reg,
+                    clf_params,
+                    reg_params,
+                    precision_avg,
+                    recall_avg,
+                    fscore_avg,
+                    rmse_avg
+                ) values (
+                    :model_id,
+                    :clf,
+                    :reg,
+                    :clf_params,
+                    :reg_params,
+                    :precision_avg,
+                    :recall_avg,
+                    :fscore_avg,
+                    :rmse_avg
+                )
+                """
+            ),
+            {
+                "model_id": model_id,
+                "clf": clf_name,
+                "reg": reg_name,
+                "clf_params": str(clf_params),
+                "reg_params": str(reg_params),
+                **averages,
+            },
+        )
+        conn.execute(
+            text(
+                """
+                insert into model_metrics (model_id, season, metric, value)
+                values (:model_id, :season, :metric, :value)
+                """
+            ),
+            season_metrics,
+        )
 
-        precision_avg = sum(precs) / len(precs)
-        recall_avg = sum(recalls) / len(recalls)
-        fscore_avg = sum(fscores) / len(fscores)
-        rmse_avg = sum(rmses) / len(rmses)
+    return model_id
 
-        logging.info(
-            f"""Avg Precision: {precision_avg}, Avg Recall: {recall_avg}, Avg F-score: {fscore_avg}, Avg RMSE: {rmse_avg}"""
-        )
 
-        metrics_d["precision_avg"] = precision_avg
-        metrics_d["recall_avg"] = recall_avg
-        metrics_d["fscore_avg"] = fscore_avg
-        metrics_d["rmse_avg"] = rmse_avg
+def get_clf(clf_model_name, clf_model_param_combo):
+    if clf_model_name == "LogisticRegression":
+        return LogisticRegression(**clf_model_param_combo)
+    elif clf_model_name == "RandomForestClassifier":
+        return RandomForestClassifier(**clf_model_param_combo)
+    elif clf_model_name == "DecisionTreeClassifer":
+        return DecisionTreeClassifier(**clf_model_param_combo)
+    elif clf_model_name == "HistGradientBoostingClassifier":
+        return HistGradientBoostingClassifier(**clf_model_param_combo)
+
 
-        return clf, reg, metrics_d
+def get_reg(reg_model_name, reg_model_param_combo):
+    if reg_model_name == "LinearRegression":
+        return LinearRegression(**reg_model_param_combo)
+    elif reg_model_name == "Ridge":
+        return Ridge(**reg_model_param_combo)
+    elif reg_model_name == "RandomForestRegressor":
+        return RandomForestRegressor(**reg_model_param_combo)
+    elif reg_model_name == "Lasso":
+        return Lasso(**reg_model_param_combo)
+    elif reg_model_name == "PoissonRegressor":
+        return PoissonRegressor(**reg_model_param_combo)
+    elif reg_model_name == "HistGradientBoostingRegressor":
+        return HistGradientBoostingRegressor(**reg_model_param_combo)
 
 
-def model_grid(df, model_config, engine):
+def get_configs(models):
     def product_dict(**kwargs):
         keys = kwargs.keys()
         vals = kwargs.values()
         for instance in itertools.product(*vals):
             yield dict(zip(keys, instance))
 
-    # iterate over all classification models
-    for clf in model_config["classification_models"]:
-        clf_model_name = list(clf.keys())[0]
-        param_dict = list(clf.values())[0]
-
-        # iterate over all possible hyperparam combos and instatiate a model object
-        for clf_model_param_combo in list(product_dict(**param_dict)):
-            if clf_model_name == "LogisticRegression":
-                clf_obj = LogisticRegression(**clf_model_param_combo)
-            elif clf_model_name == "RandomForestClassifier":
-                clf_obj = RandomForestClassifier(**clf_model_param_combo)
-            elif clf_model_name == "DecisionTreeClassifer":
-                clf_obj = DecisionTreeClassifier(**clf_model_param_combo)
-
-            # iterate over all regression models
-            for reg in model_config["regression_models"]:
-                reg_model_name = list(reg.keys())[0]
-                param_dict = list(reg.values())[0]
-
-                # iterate over all possible hyperparam combos and instatiate a model object
-                for reg_model_param_combo in list(product_dict(**param_dict)):
-                    if reg_model_name == "LinearRegression":
-                        reg_obj = LinearRegression(**reg_model_param_combo)
-                    elif reg_model_name == "Ridge":
-                        reg_obj = Ridge(**reg_model_param_combo)
-                    elif reg_model_name == "RandomForestRegressor":
-                        reg_obj = RandomForestRegressor(**reg_model_param_combo)
-                    elif reg_model_name == "Lasso":
-                        reg_obj = Lasso(**reg_model_param_combo)
-                    elif reg_model_name == "PoissonRegressor":
-                        reg_obj = PoissonRegressor(**reg_model_param_combo)
-
-                    logging.info("NEW RUN")
-                    logging.info(clf_model_name, str(clf_model_param_combo))
-                    logging.info(reg_model_name, str(reg_model_param_combo))
-
-                    # run the model
-                    clf_fit, reg_fit, metric_d = run_model(df, clf_obj, reg_obj)
-
-                    # save model artifact as pickle
-                    clf_bin_str = pickle.dumps(clf_fit)
-                    reg_bin_str = pickle.dumps(reg_fit)
-
-                    # write model run to database
-                    sql = """
-                    insert into model (
-                        model_id,
-                        clf_model_object,
-                        reg_model_object,
-                        clf,
-                        reg,
-                        clf_params,
-                        reg_params,
-                        precision_avg,
-                        recall_avg,
-                        fscore_avg,
-                        rmse_avg,
-                        precision_2006,
-                        recall_2006,
-                        fscore_2006,
-                        rmse_2006,
-                        precision_2007,
-                        recall_2007,
-                        fscore_2007,
-                        rmse_2007,
-                        precision_2008,
-                        recall_2008,
-                        fscore_2008,
-                        rmse_2008,
-                        precision_2009,
-                        recall_2009,
-                        fscore_2009,
-                        rmse_2009,
-                        precision_2010,
-                        recall_2010,
-                        fscore_2010,
-                        rmse_2010,
-                        precision_2011,
-                        recall_2011,
-                        fscore_2011,
-                        rmse_2011,
-                        precision_2012,
-                        recall_2012,
-                        fscore_2012,
-                        rmse_2012,
-                        precision_2013,
-                        recall_2013,
-                        fscore_2013,
-                        rmse_2013,
-                        precision_2014,
-                        recall_2014,
-                        fscore_2014,
-                        rmse_2014,
-                        precision_2015,
-                        recall_2015,
-                        fscore_2015,
-                        rmse_2015,
-                        precision_2016,
-                        recall_2016,
-                        fscore_2016,
-                        rmse_2016,
-                        precision_2017,
-                        recall_2017,
-                        fscore_2017,
-                        rmse_2017,
-                        precision_2018,
-                        recall_2018,
-                        fscore_2018,
-                        rmse_2018,
-                        precision_2019,
-                        recall_2019,
-                        fscore_2019,
-                        rmse_2019,
-                        precision_2020,
-                        recall_2020,
-                        fscore_2020,
-                        rmse_2020,
-                        precision_2021,
-                        recall_2021,
-                        fscore_2021,
-                        rmse_2021
-                    ) values (
-                        %s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s
-                    )
-                    """
-                    with engine.connect().execution_options(autocommit=True) as conn:
-                        query = conn.execute(
-                            sql,
-                            (
-                                str(uuid.uuid4()),
-                                clf_bin_str,
-                                reg_bin_str,
-                                clf_model_name,
-                                reg_model_name,
-                                str(clf_model_param_combo),
-                                str(reg_model_param_combo),
-                                metric_d["precision_avg"],
-                                metric_d["recall_avg"],
-                                metric_d["fscore_avg"],
-                                metric_d["rmse_avg"],
-                                metric_d["precision_2006"],
-                                metric_d["recall_2006"],
-                                metric_d["fscore_2006"],
-                                metric_d["rmse_2006"],
-                                metric_d["precision_2007"],
-                                metric_d["recall_2007"],
-                                metric_d["fscore_2007"],
-                                metric_d["rmse_2007"],
-                                metric_d["precision_2008"],
-                                metric_d["recall_2008"],
-                                metric_d["fscore_2008"],
-                                metric_d["rmse_2008"],
-                                metric_d["precision_2009"],
-                                metric_d["recall_2009"],
-                                metric_d["fscore_2009"],
-                                metric_d["rmse_2009"],
-                                metric_d["precision_2010"],
-                                metric_d["recall_2010"],
-                                metric_d["fscore_2010"],
-                                metric_d["rmse_2010"],
-                                metric_d["precision_2011"],
-                                metric_d["recall_2011"],
-                                metric_d["fscore_2011"],
-                                metric_d["rmse_2011"],
-                                metric_d["precision_2012"],
-                                metric_d["recall_2012"],
-                                metric_d["fscore_2012"],
-                                metric_d["rmse_2012"],
-                                metric_d["precision_2013"],
-                                metric_d["recall_2013"],
-                                metric_d["fscore_2013"],
-                                metric_d["rmse_2013"],
-                                metric_d["precision_2014"],
-                                metric_d["recall_2014"],
-                                metric_d["fscore_2014"],
-                                metric_d["rmse_2014"],
-                                metric_d["precision_2015"],
-                                metric_d["recall_2015"],
-                                metric_d["fscore_2015"],
-                                metric_d["rmse_2015"],
-                                metric_d["precision_2016"],
-                                metric_d["recall_2016"],
-                                metric_d["fscore_2016"],
-                                metric_d["rmse_2016"],
-                                metric_d["precision_2017"],
-                                metric_d["recall_2017"],
-                                metric_d["fscore_2017"],
-                                metric_d["rmse_2017"],
-                                metric_d["precision_2018"],
-                                metric_d["recall_2018"],
-                                metric_d["fscore_2018"],
-                                metric_d["rmse_2018"],
-                                metric_d["precision_2019"],
-                                metric_d["recall_2019"],
-                                metric_d["fscore_2019"],
-                                metric_d["rmse_2019"],
-                                metric_d["precision_2020"],
-                                metric_d["recall_2020"],
-                                metric_d["fscore_2020"],
-                                metric_d["rmse_2020"],
-                                metric_d["precision_2021"],
-                                metric_d["recall_2021"],
-                                metric_d["fscore_2021"],
-                                metric_d["rmse_2021"],
-                            ),
-                        )
-
-                    logging.info("\n")
+    # every model x hyperparam combo in one section of model_config.yml, as
+    # (name, params). a section lists models by their name in get_clf or
+    # get_reg, each with lists of values to try:
+    #
+    #   classification_models:
+    #     - HistGradientBoostingClassifier:
+    #         learning_rate: [0.05, 0.1]
+    #         max_leaf_nodes: [15, 31]
+    #   regression_models:
+    #     - HistGradientBoostingRegressor:
+    #         learning_rate: [0.1]
+    configs = []
+    for model in models:
+        model_name = list(model.keys())[0]
+        for model_param_combo in product_dict(**list(model.values())[0]):
+            configs.append((model_name, model_param_combo))
+
+    return configs
+
+
+def get_estimator_jobs(jobs, fold_jobs):
+    # cores left for each estimator's own n_jobs once the grid workers and
+    # the concurrent folds have each taken theirs
+    return max(1, (os.cpu_count() or 1) // (jobs * fold_jobs))
+
+
+def get_task_estimator(task):
+    kind, _, model_name, model_param_combo = task
+    if kind == "clf":
+        return get_clf(model_name, model_param_combo)
+    return get_reg(model_name, model_param_combo)
+
+
+def run_stage(plan, task, fold_jobs=1, estimator_jobs=1, fold_ids=None):
+    # one classifier or regressor config, fit on the given folds (all of them
+    # by default)
+    kind, _, _, model_param_combo = task
+    obj = get_task_estimator(task)
+
+    # estimators that parallelise themselves (the random forests) get the
+    # leftover cores, unless the config pins n_jobs itself
+    if "n_jobs" in obj.get_params() and "n_jobs" not in model_param_combo:
+        obj.set_params(n_jobs=estimator_jobs)
+
+    # the gradient boosting models get year, position, team and conference as
+    # category codes (see features.FeatureEncoder.transform_codes) instead of
+    # the one-hot columns, those of them that fit in the config's max_bins
+    if (
+        isinstance(obj, features.CODED_ESTIMATORS)
+        and "categorical_features" not in model_param_combo
+    ):
+        obj.set_params(
+            categorical_features=plan["encoder"].get_categorical_mask(
+                obj.get_params()["max_bins"]
+            )
+        )
+
+    if kind == "clf":
+        return run_clf(plan, obj, fold_jobs, fold_ids)
+    return run_reg(plan, obj, fold_jobs, fold_ids)
+
+
+def write_plan(plan, path):
+    # the planned matrices as .npy files (csr ones as their three arrays), so
+    # pool workers can load them memory-mapped instead of each planning the
+    # folds again. the encoder and the fold bounds are small and pickled. the
+    # frame is left behind, it's only needed to build matrices and every one
+    # the configs ask for has been built by now
+    rest = {"csr": {}}
+    for key, value in plan.items():
+        if key == "df":
+            continue
+        if isinstance(value, np.ndarray):
+            np.save(path.joinpath(f"{key}.npy"), value)
+        elif sparse.issparse(value):
+            for part in ("data", "indices", "indptr"):
+                np.save(path.joinpath(f"{key}.{part}.npy"), getattr(value, part))
+            rest["csr"][key] = value.shape
+        else:
+            rest[key] = value
+
+    with open(path.joinpath("plan.pkl"), "wb") as f:
+        pickle.dump(rest, f)
+
+
+def load_plan(path):
+    with open(path.joinpath("plan.pkl"), "rb") as f:
+        plan = pickle.load(f)
+
+    for key, shape in plan.pop("csr").items():
+        parts = [
+            np.load(path.joinpath(f"{key}.{part}.npy"), mmap_mode="r")
+            for part in ("data", "indices", "indptr")
+        ]
+        plan[key] = sparse.csr_matrix(tuple(parts), shape=shape, copy=False)
+    for file in path.glob("*.npy"):
+        key = file.name[: -len(".npy")]
+        if "." not in key:
+            plan[key] = np.load(file, mmap_mode="r")
+
+    return plan
+
+
+# each worker process loads the plan the grid wrote once, memory-mapped, and
+# fits every config it's given from it. workers on the same plan share one
+# copy of it through the page cache
+worker_plan = None
+
+
+def init_worker(plan_path, estimator_jobs):
+    global worker_plan
+    worker_plan = load_plan(plan_path)
+
+    # the pool is the parallelism, keep each worker's blas to its share of
+    # the cores so jobs x blas threads doesn't oversubscribe them
+    threadpoolctl.threadpool_limits(estimator_jobs)
+
+
+def run_stage_in_worker(task, fold_jobs, estimator_jobs, fold_ids=None):
+    return run_stage(worker_plan, task, fold_jobs, estimator_jobs, fold_ids)
+
+
+def rank_score(plan, kind, run):
+    # how a config is judged between rungs of successive_halving, on the folds
+    # it's been fit on so far: a classifier by the f-score of its picks, a
+    # regressor by its rmse over each test season's actual vote getters, so
+    # neither depends on what it'll be paired with. higher is better
+    if kind == "clf":
+        return np.mean(
+            [fold_metrics["fscore"] for fold_metrics in run["metrics"].values()]
+        )
+
+    rmses = []
+    for i, y_pred in run["predictions"].items():
+        votes = plan["votes"][plan["folds"][i]["test"]]
+        voted = votes > 0
+        # a season without ballots (not scraped yet) has nothing to score
+        if voted.any():
+            rmses.append(math.sqrt(mean_squared_error(votes[voted], y_pred[voted])))
+    # every config in a rung has the same folds, so if none of them could be
+    # scored the regressors all tie
+    return -np.mean(rmses) if rmses else 0.0
+
+
+def successive_halving(plan, tasks, fit, min_folds=3, factor=3):
+    # a budgeted search instead of fitting every config on every fold. each
+    # config is fit on the min_folds most recent seasons, then only the best
+    # 1/factor of each stage's configs go on to factor times as many seasons,
+    # and so on until the survivors have been fit on all of them. runs carry
+    # over between rungs, so no fold is fit twice and the survivors end up
+    # with the same complete runs the full grid would give them
+    if factor < 2:
+        raise ValueError("successive halving needs a factor of at least 2")
+
+    order = list(reversed(range(len(plan["folds"]))))
+    runs = {}
+    fitted = 0
+    budget = min(max(min_folds, 1), len(order))
+    while True:
+        for task, run in fit(tasks, order[fitted:budget]):
+            key = task[:2]
+            runs[key] = merge_runs(runs[key], run) if key in runs else run
+        fitted = budget
+        if fitted == len(order):
+            break
+
+        survivors = []
+        for kind in ("clf", "reg"):
+            stage = [task for task in tasks if task[0] == kind]
+            stage.sort(
+                key=lambda task: rank_score(plan, kind, runs[task[:2]]), reverse=True
+            )
+            survivors += stage[: math.ceil(len(stage) / factor)]
+
+        progress = (
+            f"kept {len(survivors)} of {len(tasks)} configs "
+            f"after {fitted} of {len(order)} seasons"
+        )
+        print(progress)
+        logging.info(progress)
+        tasks = survivors
+        budget = min(fitted * factor, len(order))
+
+    return [(task, runs[task[:2]]) for task in tasks]
+
+
+def model_grid(
+    snapshot_path,
+    model_config,
+    engine,
+    jobs=1,
+    fold_jobs=1,
+    search="grid",
+    min_folds=3,
+    factor=3,
+):
+    clfs = get_configs(model_config["classification_models"])
+    regs = get_configs(model_config["regression_models"])
+    estimator_jobs = get_estimator_jobs(jobs, fold_jobs)
+
+    # the classifier's picks don't depend on the regressor and the regressor's
+    # training set doesn't depend on the classifier, so rather than refit both
+    # for every pair, each config is fit once per fold (C + R fits instead of
+    # C x R) and every pair is scored from the two cached runs
+    tasks = [("clf", i, name, params) for i, (name, params) in enumerate(clfs)]
+    tasks += [("reg", i, name, params) for i, (name, params) in enumerate(regs)]
+
+    # the folds are planned once, here. the workers only fit, this process
+    # scores every pair as soon as both halves are in and is the single
+    # writer, which needs the targets, the fold bounds and the encoder
+    plan = plan_folds(snapshot.load(snapshot_path))
+
+    limits = None
+    plan_path = None
+    if jobs > 1:
+        # build every layout the configs will ask for and hand the workers
+        # the lot through a temp directory. it's written per run, so it's
+        # never stale against this version of plan_folds, and kept out of the
+        # snapshot cache so a crashed run can't leave it looking like an entry
+        for task in tasks:
+            get_matrices(plan, get_task_estimator(task))
+        plan_path = Path(tempfile.mkdtemp(prefix="heisman-plan-"))
+        write_plan(plan, plan_path)
+        pool = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_worker,
+            initargs=(plan_path, estimator_jobs),
+        )
+    else:
+        pool = None
+        # fitting in this process, with fold_jobs threads: the same blas
+        # share as a worker gets, or the folds' blas threads oversubscribe
+        limits = threadpoolctl.threadpool_limits(estimator_jobs)
+
+    def fit(tasks, fold_ids=None):
+        # (task, run) for each of the tasks, as they finish
+        if pool is None:
+            return (
+                (task, run_stage(plan, task, fold_jobs, estimator_jobs, fold_ids))
+                for task in tasks
+            )
+
+        futures = {
+            pool.submit(
+                run_stage_in_worker, task, fold_jobs, estimator_jobs, fold_ids
+            ): task
+            for task in tasks
+        }
+        return ((futures[f], f.result()) for f in as_completed(futures))
+
+    clf_runs = {}
+    reg_runs = {}
+    done = 0
+    try:
+        if search == "halving":
+            results = successive_halving(plan, tasks, fit, min_folds, factor)
+            clf_count = sum(1 for (kind, _, _, _), _ in results if kind == "clf")
+            total = clf_count * (len(results) - clf_count)
+        else:
+            results = fit(tasks)
+            total = len(clfs) * len(regs)
+
+        for (kind, i, _, _), run in results:
+            if kind == "clf":
+                clf_runs[i] = run
+                pairs = [(i, j) for j in reg_runs]
+            else:
+                reg_runs[i] = run
+                pairs = [(j, i) for j in clf_runs]
+
+            for clf_i, reg_i in pairs:
+                clf_model_name, clf_model_param_combo = clfs[clf_i]
+                reg_model_name, reg_model_param_combo = regs[reg_i]
+                logging.info("NEW RUN")
+                logging.info(f"{clf_model_name} {clf_model_param_combo}")
+                logging.info(f"{reg_model_name} {reg_model_param_combo}")
+                metric_d = score_model(plan, clf_runs[clf_i], reg_runs[reg_i])
+
+                # write model run to database
+                write_model_run(
+                    engine,
+                    clf_model_name,
+                    reg_model_name,
+                    clf_model_param_combo,
+                    reg_model_param_combo,
+                    clf_runs[clf_i]["model"],
+                    reg_runs[reg_i]["model"],
+                    metric_d,
+                    plan["encoder"],
+                )
+
+                done += 1
+                progress = (
+                    f"[{done}/{total}] "
+                    f"{clf_model_name} {clf_model_param_combo} "
+                    f"{reg_model_name} {reg_model_param_combo}: "
+                    f"precision {metric_d['precision_avg']:.3f}, "
+                    f"rmse {metric_d['rmse_avg']:.1f}"
+                )
+                print(progress)
+                logging.info(progress)
+                logging.info("\n")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+            shutil.rmtree(plan_path, ignore_errors=True)
+        if limits is not None:
+            limits.restore_original_limits()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes to spread the grid over",
+    )
+    parser.add_argument(
+        "--fold-jobs",
+        type=int,
+        default=1,
+        help="number of walk-forward folds to fit concurrently per config",
+    )
+    parser.add_argument(
+        "--search",
+        choices=["grid", "halving"],
+        default="grid",
+        help="fit every config on every season, or prune by successive halving",
+    )
+    parser.add_argument(
+        "--min-folds",
+        type=int,
+        default=3,
+        help="seasons every config is fit on before halving prunes any",
+    )
+    parser.add_argument(
+        "--halving-factor",
+        type=int,
+        default=3,
+        help="keep 1/factor of the configs per rung, with factor x the seasons",
+    )
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     dirname = os.path.dirname(__file__)
     secrets_filename = os.path.join(dirname, "../config.yml")
     model_config_filename = os.path.join(dirname, "model_config.yml")
@@ -386,10 +826,25 @@ def main():
 
     secrets = get_yaml(secrets_filename)
     engine = connect_to_db(secrets)
-    df = retrieve_data(engine)
-    df = data_prep(df)
+    # the typed frame is snapshotted per version of the data and of the
+    # columns read, so reruns on unchanged data skip the read
+    snapshot_path = snapshot.ensure(
+        engine,
+        FEATURE_SQL,
+        lambda: retrieve_data(engine),
+        version=repr(FEATURE_DTYPES),
+    )
     model_config = get_yaml(model_config_filename)
-    model_grid(df, model_config, engine)
+    model_grid(
+        snapshot_path,
+        model_config,
+        engine,
+        args.jobs,
+        args.fold_jobs,
+        args.search,
+        args.min_folds,
+        args.halving_factor,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+
+# columnar snapshots of prepared frames. a snapshot is a directory named after
+# the query it was built from and player_feature's version (bumped by every
+# build_db.refresh_player_features), holding one .npy matrix per numeric
+# dtype and one .npy per text column. they're loaded memory-mapped, so a grid
+# run starts without touching the db and every process that loads the same
+# snapshot shares one copy of it through the page cache
+SNAPSHOT_DIR = Path(__file__).parent.joinpath("../.cache/snapshots").resolve()
+
+
+def data_hash(engine, sql, version=""):
+    # the rows sql selects only change when player_feature is refreshed, so
+    # its version stands in for them and the table is never scanned. version
+    # is folded in so a change to how the frame is prepared gets a new
+    # snapshot too
+    with engine.connect() as conn:
+        watermark = conn.execute(
+            text("select version from player_feature_version;")
+        ).scalar()
+
+    key = json.dumps([sql, watermark, version])
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def write(df, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # write into a scratch directory and rename it into place, so a reader
+    # never sees half a snapshot
+    tmp = Path(tempfile.mkdtemp(prefix=".snapshot-", dir=path.parent))
+    manifest = {"blocks": [], "text": []}
+    numeric = df.select_dtypes(include=["number", "bool"])
+    for dtype, columns in numeric.columns.groupby(numeric.dtypes).items():
+        # one C-ordered matrix per dtype, becomes a single pandas block on load
+        values = np.ascontiguousarray(numeric[list(columns)].to_numpy(dtype=dtype))
+        np.save(tmp.joinpath(f"{dtype}.npy"), values)
+        manifest["blocks"].append({"dtype": str(dtype), "columns": list(columns)})
+    for i, column in enumerate(df.columns.difference(numeric.columns)):
+        np.save(tmp.joinpath(f"text_{i}.npy"), df[column].astype(str).to_numpy("U"))
+        manifest["text"].append(column)
+
+    with open(tmp.joinpath("manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another process wrote the same snapshot first
+        shutil.rmtree(tmp)
+
+
+def load(path):
+    path = Path(path)
+    with open(path.joinpath("manifest.json")) as f:
+        manifest = json.load(f)
+
+    # copy=False keeps each block a view of its memory map
+    frames = [
+        pd.DataFrame(
+            np.load(path.joinpath(f"{block['dtype']}.npy"), mmap_mode="r"),
+            columns=block["columns"],
+            copy=False,
+        )
+        for block in manifest["blocks"]
+    ]
+    df = pd.concat(frames, axis=1, copy=False) if frames else pd.DataFrame()
+    for i, column in enumerate(manifest["text"]):
+        df[column] = np.load(path.joinpath(f"text_{i}.npy")).astype(object)
+
+    return df
+
+
+def ensure(engine, sql, build, version=""):
+    # path of the snapshot of build()'s frame for the rows sql selects,
+    # building and writing it first if those rows haven't been snapshotted yet
+    path = SNAPSHOT_DIR.joinpath(data_hash(engine, sql, version))
+    if not path.joinpath("manifest.json").exists():
+        write(build(), path)
+
+    return path
+
+
+def cached(engine, sql, build, version=""):
+    return load(ensure(engine, sql, build, version))
@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../experiments")
+)
+
+import run_models
+
+
+def make_player_features(teams=70, players_per_season=140):
+    # a few raw player_feature rows per season in the columns plan_folds
+    # reads, with more teams than a small max_bins can code
+    rng = np.random.default_rng(0)
+    frames = []
+    for season in range(2000, 2022):
+        votes = np.zeros(players_per_season)
+        votes[rng.choice(players_per_season, 10, replace=False)] = rng.integers(
+            1, 3000, 10
+        )
+        team = rng.integers(0, teams, players_per_season)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "player_id": [f"p-{season}-{i}" for i in range(players_per_season)],
+                    "season": season,
+                    "year": rng.choice(["FR", "SO", "JR", "SR"], players_per_season),
+                    "position": rng.choice(["QB", "RB", "WR"], players_per_season),
+                    "team_abbreviation": [f"TEAM-{t}" for t in team],
+                    "conference": [f"conf-{t % 10}" for t in team],
+                    "passing_yards": rng.integers(0, 5000, players_per_season),
+                    "rushing_yards": rng.integers(0, 2000, players_per_season),
+                    "win_percentage": rng.random(players_per_season),
+                    "votes": votes,
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_small_max_bins_one_hots_wide_categoricals():
+    plan = run_models.plan_folds(make_player_features())
+    fold_ids = [len(plan["folds"]) - 1]
+
+    # 70 teams don't fit in 15 bins, so team_abbreviation stays one-hot and
+    # only the narrower categoricals are coded
+    clf_run = run_models.run_stage(
+        plan,
+        ("clf", 0, "HistGradientBoostingClassifier", {"max_bins": 15}),
+        fold_ids=fold_ids,
+    )
+    reg_run = run_models.run_stage(
+        plan,
+        ("reg", 0, "HistGradientBoostingRegressor", {"max_bins": 15}),
+        fold_ids=fold_ids,
+    )
+
+    encoder = plan["encoder"]
+    assert "team_abbreviation" not in encoder.get_coded(15)
+    assert "conference" in encoder.get_coded(15)
+    mask = clf_run["model"].get_params()["categorical_features"]
+    assert mask.sum() == 3
+    assert len(mask) == plan["X_codes_15"].shape[1]
+    assert len(reg_run["predictions"][fold_ids[0]]) == 140
+
+    # the default max_bins still codes every categorical
+    assert len(encoder.get_coded()) == 4